@@ -0,0 +1,414 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import cProfile
+import pstats
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rerank
+
+SCENARIOS = ('preprocess', 'rebuild', 'query', 'sync', 'rerank')
+WORDS = ('car truck engine electric battery review price sedan suv hybrid tire brake speed ford tesla toyota '
+         'honda chevrolet interior range charging towing mpg warranty lease dealer recall safety rating '
+         'horsepower torque transmission awd cabin cargo seats infotainment navigation').split()
+
+
+# Function to build one synthetic WordPress post body with block comments, markup, links and scripts
+def fixture_post(rng, post_id):
+    parts = [f'<!-- wp:heading --><h2>Post {post_id}: {" ".join(rng.choices(WORDS, k=6)).title()}</h2>'
+             f'<!-- /wp:heading -->']
+    for _ in range(rng.randint(3, 30)):
+        kind = rng.random()
+        words = ' '.join(rng.choices(WORDS, k=rng.randint(20, 120)))
+        if kind < 0.6:
+            parts.append(f'<!-- wp:paragraph --><p>{words} &amp; <a href="https://example.com/{post_id}">'
+                         f'more</a> for $' + f'{rng.randint(20, 90)},{rng.randint(100, 999)}.</p>'
+                         f'<!-- /wp:paragraph -->')
+        elif kind < 0.8:
+            items = ''.join(f'<li>{w}</li>' for w in rng.choices(WORDS, k=5))
+            parts.append(f'<!-- wp:list --><ul>{items}</ul><!-- /wp:list -->')
+        elif kind < 0.9:
+            parts.append(f'<!-- wp:image --><figure class="wp-block-image"><img src="https://cdn.example.com/'
+                         f'{post_id}.jpg" alt=""/><figcaption>{words[:80]}</figcaption></figure><!-- /wp:image -->')
+        else:
+            parts.append(f'<script type="application/ld+json">{{"@type": "Article", "id": {post_id}}}</script>'
+                         f'<p>{words} https://example.com/ref?id={post_id}</p>')
+    return '\n'.join(parts)
+
+
+class FixtureBlog:
+    """Synthetic wp_posts table standing in for the blog database."""
+
+    def __init__(self, posts, eligible_share=0.9, seed=1):
+        rng = random.Random(seed)
+        start = datetime(2024, 1, 1)
+        self.rows = {}
+        for post_id in range(1, posts + 1):
+            post_date = start + timedelta(hours=rng.randint(0, 24 * 600))
+            self.rows[post_id] = (post_id, fixture_post(rng, post_id), post_date, post_date)
+        # Posts outside the eligibility query exercise the fetch-and-embed path at query time
+        self.eligible = set(rng.sample(sorted(self.rows), int(posts * eligible_share)))
+        self.rng = rng
+
+    def edit(self, share):
+        # Edit a share of eligible posts so the next incremental rebuild re-embeds them
+        edited = self.rng.sample(sorted(self.eligible), int(len(self.eligible) * share))
+        for post_id in edited:
+            post_id, content, post_date, _ = self.rows[post_id]
+            self.rows[post_id] = (post_id, content + '<p>Updated with new pricing.</p>', post_date, datetime.now())
+        return len(edited)
+
+    def fetch_all(self, sql_query, params=()):
+        # Term lookups resolve to one tag and one category; every other query is the eligibility stage
+        if 'wp_term_taxonomy' in sql_query:
+            return [(1, 'post_tag'), (2, 'category')]
+        return [(post_id, post_date, post_modified) for post_id, _, post_date, post_modified
+                in (self.rows[post_id] for post_id in sorted(self.eligible))]
+
+    def fetch_post_content(self, post_id):
+        row = self.rows.get(int(post_id))
+        return row[1] if row else None
+
+    def fetch_post_contents(self, post_ids):
+        return {str(post_id): self.rows[int(post_id)][1] for post_id in post_ids if int(post_id) in self.rows}
+
+    def install(self, db):
+        db.fetch_all = self.fetch_all
+        db.fetch_post_content = self.fetch_post_content
+        db.fetch_post_contents = self.fetch_post_contents
+
+
+# Synthetic reranking fixture: a few topics, each with near-duplicate posts of mixed ages
+def fixture_corpus(topics=10, posts_per_topic=20, dimensions=384, seed=7, now=1.7e9):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dimensions))
+    embeddings, timestamps, topic_ids = [], [], []
+    for topic, center in enumerate(centers):
+        for _ in range(posts_per_topic):
+            embeddings.append(center + rng.normal(scale=0.35, size=dimensions))
+            timestamps.append(now - rng.uniform(0, 3 * 365) * rerank.SECONDS_PER_DAY)
+            topic_ids.append(topic)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings, np.asarray(timestamps), np.asarray(topic_ids)
+
+
+# Function to summarize a set of picked posts: relevance, age, redundancy and topic coverage
+def selection_stats(picked, similarities, embeddings, timestamps, topic_ids, now):
+    picked_embeddings = embeddings[picked]
+    pairwise = picked_embeddings @ picked_embeddings.T
+    return {
+        'mean_similarity': float(similarities[picked].mean()),
+        'mean_age_days': float(((now - timestamps[picked]) / rerank.SECONDS_PER_DAY).mean()),
+        'mean_pairwise_similarity': float(pairwise[np.triu_indices(len(picked), 1)].mean()),
+        'topics': len(set(topic_ids[picked])),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is the peak for the whole process so far, in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def latency_summary(samples, elapsed):
+    samples = np.asarray(samples) * 1000
+    return {
+        'count': len(samples),
+        'seconds': round(elapsed, 3),
+        'throughput_per_s': round(len(samples) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(float(np.percentile(samples, 50)), 3) if len(samples) else None,
+        'p99_ms': round(float(np.percentile(samples, 99)), 3) if len(samples) else None,
+    }
+
+
+@contextmanager
+def profiled(name, mode, output_dir):
+    """Profile the enclosed scenario with cProfile or an attached py-spy, writing the result to output_dir."""
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = os.path.join(output_dir, f'{name}.prof')
+            profiler.dump_stats(path)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(15)
+            print(f"cProfile output for {name} written to {path}", file=sys.stderr)
+    elif mode == 'py-spy':
+        path = os.path.join(output_dir, f'{name}.svg')
+        process = subprocess.Popen(['py-spy', 'record', '--pid', str(os.getpid()), '--output', path,
+                                    '--rate', '200', '--nonblocking'])
+        try:
+            yield
+        finally:
+            process.terminate()
+            process.wait()
+            print(f"py-spy flame graph for {name} written to {path}", file=sys.stderr)
+    else:
+        yield
+
+
+def run_preprocess(blog, retriever):
+    from preprocess import preprocess_text, preprocess_texts, create_preprocess_executor
+    texts = [row[1] for row in blog.rows.values()]
+    samples = []
+    started = time.perf_counter()
+    for text in texts:
+        t = time.perf_counter()
+        preprocess_text(text)
+        samples.append(time.perf_counter() - t)
+    result = {'preprocess_text': latency_summary(samples, time.perf_counter() - started)}
+
+    executor = create_preprocess_executor()
+    try:
+        started = time.perf_counter()
+        preprocess_texts(texts, executor)
+        result['preprocess_texts'] = {'count': len(texts), 'seconds': round(time.perf_counter() - started, 3),
+                                      'workers': executor._max_workers if executor else 1}
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # The BeautifulSoup path that preprocess_text replaced, for comparison when bs4 is installed
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return result
+    import re
+
+    def soup_preprocess(text):
+        text = BeautifulSoup(text, 'html.parser').get_text().lower()
+        text = re.sub(r'http\S+', '', text)
+        text = re.sub(r'[^a-zA-Z0-9\s$]', '', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    samples = []
+    started = time.perf_counter()
+    for text in texts:
+        t = time.perf_counter()
+        soup_preprocess(text)
+        samples.append(time.perf_counter() - t)
+    result['beautifulsoup_baseline'] = latency_summary(samples, time.perf_counter() - started)
+    return result
+
+
+def run_rerank(runs=2000, nresults=6):
+    # A query between two topics of the fixture corpus, so both recency and diversity change the picks
+    now = 1.7e9
+    embeddings, timestamps, topic_ids = fixture_corpus(now=now)
+    query = embeddings[0] + embeddings[25]
+    query /= np.linalg.norm(query)
+    similarities = embeddings @ query
+    candidates = np.argsort(-similarities)[1:rerank.RERANK_CANDIDATES + 1]
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        t = time.perf_counter()
+        rerank.rerank(similarities[candidates], embeddings[candidates], timestamps[candidates], nresults, now=now)
+        samples.append(time.perf_counter() - t)
+    result = {'rerank': latency_summary(samples, time.perf_counter() - started), 'candidates': len(candidates)}
+
+    for name, weights in (('nearest', dict(recency_weight=0, diversity=0)), ('reranked', rerank.DEFAULT_WEIGHTS)):
+        picked = candidates[rerank.rerank(similarities[candidates], embeddings[candidates], timestamps[candidates],
+                                          nresults, now=now, **weights)]
+        result[name] = selection_stats(picked, similarities, embeddings, timestamps, topic_ids, now)
+    return result
+
+
+def rebuild_db_ms(retriever):
+    # Each rebuild records one rebuild_db observation, so its median is that rebuild's database time
+    return retriever.metrics.registry.collect().get('rebuild_db_ms_p50')
+
+
+def run_rebuild(blog, retriever, edit_share):
+    result = {}
+    rebuild_db_ms(retriever)
+    started = time.perf_counter()
+    retriever.update_chroma_collection(full_rebuild=True)
+    result['full'] = {'seconds': round(time.perf_counter() - started, 3), 'posts': len(blog.eligible),
+                      'chunks': retriever.collection.count(), 'db_ms': rebuild_db_ms(retriever)}
+    edited = blog.edit(edit_share)
+    # Generation names have one-second resolution
+    time.sleep(1)
+    started = time.perf_counter()
+    retriever.update_chroma_collection(full_rebuild=False)
+    result['incremental'] = {'seconds': round(time.perf_counter() - started, 3), 'edited_posts': edited,
+                             'db_ms': rebuild_db_ms(retriever)}
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_query(blog, retriever, concurrency, queries, cached):
+    from cache import TTLCache
+    if not cached:
+        # A zero-size cache makes every request take the full lookup, embed and rank path
+        retriever.results_cache = TTLCache(maxsize=0)
+    rng = random.Random(2)
+    indexed = sorted(blog.eligible)
+    not_indexed = sorted(set(blog.rows) - blog.eligible) or indexed
+    post_ids = [rng.choice(not_indexed) if rng.random() < 0.1 else rng.choice(indexed) for _ in range(queries)]
+    retriever.get_results(post_ids[0], 6)
+
+    samples = []
+    lock = threading.Lock()
+
+    def query(post_id):
+        t = time.perf_counter()
+        retriever.get_results(post_id, 6)
+        elapsed = time.perf_counter() - t
+        with lock:
+            samples.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(query, post_ids))
+    result = latency_summary(samples, time.perf_counter() - started)
+    result.update(concurrency=concurrency, cached=cached, backend=retriever.VECTOR_BACKEND,
+                  peak_rss_mb=peak_rss_mb())
+    return result
+
+
+def run_sync(blog, retriever):
+    try:
+        import boto3
+        from moto import mock_aws
+    except ImportError:
+        return {'skipped': 'moto is not installed (pip install moto)'}
+    for key in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        os.environ.setdefault(key, 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    with mock_aws():
+        region = os.getenv('AWS_REGION', 'us-east-1')
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=f'autoblog-ai-{retriever.ENV}-{region}')
+        started = time.perf_counter()
+        retriever.s3_upload()
+        upload_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        retriever.sync_chromadb()
+        sync_seconds = time.perf_counter() - started
+        # A second sync of an unchanged snapshot should only verify checksums
+        retriever.synced_snapshot_version = None
+        started = time.perf_counter()
+        retriever.sync_chromadb()
+        resync_seconds = time.perf_counter() - started
+    return {'upload_seconds': round(upload_seconds, 3), 'sync_seconds': round(sync_seconds, 3),
+            'resync_unchanged_seconds': round(resync_seconds, 3), 'chunks': retriever.collection.count(),
+            'peak_rss_mb': peak_rss_mb()}
+
+
+# Function to print how each number moved against a saved baseline and report regressions beyond the threshold
+def compare(results, baseline, threshold):
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if isinstance(value, dict) and isinstance(previous.get(key), dict):
+                walk(value, previous[key], f"{path}{key}.")
+            elif isinstance(value, (int, float)) and isinstance(previous.get(key), (int, float)) and previous[key]:
+                change = (value - previous[key]) / previous[key]
+                print(f"{path}{key}: {previous[key]} -> {value} ({change:+.1%})")
+                # Throughput regresses when it falls; everything else timed regresses when it grows
+                worse = -change if key.startswith('throughput') else change
+                if (key.endswith(('_ms', 'seconds')) or key.startswith('throughput')) and worse > threshold:
+                    regressions.append(f"{path}{key}")
+
+    walk(results['scenarios'], baseline.get('scenarios', {}), '')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the retriever hot paths against local stand-ins')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--cached', action='store_true', help='Keep the results cache on during the query scenario')
+    parser.add_argument('--edit-share', type=float, default=0.05, help='Share of posts edited before the '
+                                                                       'incremental rebuild')
+    parser.add_argument('--vector-backend', choices=('chroma', 'numpy'), default='chroma')
+    parser.add_argument('--profile', choices=('cprofile', 'py-spy'))
+    parser.add_argument('--output', help='Write results as a JSON baseline to this path')
+    parser.add_argument('--baseline', help='Compare against a JSON baseline written by an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+    scenarios = [name for name in args.scenarios.split(',') if name]
+
+    # Everything the retriever touches lives in a scratch directory; embeddings are computed locally
+    workdir = tempfile.mkdtemp(prefix='retriever-benchmark-')
+    os.environ.update(EMBEDDING_BACKEND='local', VECTOR_BACKEND=args.vector_backend,
+                      CHROMA_PATH=os.path.join(workdir, 'chromadb'),
+                      SYNC_STAGING_PATH=os.path.join(workdir, 'chromadb_sync'),
+                      EMBEDDING_CHECKPOINT_PATH=os.path.join(workdir, 'embedding_checkpoint.jsonl'),
+                      ENABLE_SCHEDULER='false')
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    import db
+    import retriever
+
+    blog = FixtureBlog(args.posts)
+    blog.install(db)
+    upload = retriever.s3_upload
+    # Rebuilds are timed without their S3 upload; the sync scenario times it separately
+    retriever.s3_upload = lambda: None
+
+    results = {
+        'created': datetime.utcnow().isoformat(),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'settings': {'posts': args.posts, 'concurrency': args.concurrency, 'queries': args.queries,
+                     'vector_backend': args.vector_backend},
+        'scenarios': {},
+    }
+    try:
+        for name in SCENARIOS:
+            if name not in scenarios:
+                continue
+            if name in ('query', 'sync') and not retriever.load_index().count():
+                # Queries and syncs need an index to work on
+                run_rebuild(blog, retriever, args.edit_share)
+            print(f"Running {name}...", file=sys.stderr)
+            with profiled(name, args.profile, os.path.dirname(os.path.abspath(args.output or 'benchmark.json'))):
+                if name == 'preprocess':
+                    results['scenarios'][name] = run_preprocess(blog, retriever)
+                elif name == 'rebuild':
+                    results['scenarios'][name] = run_rebuild(blog, retriever, args.edit_share)
+                elif name == 'query':
+                    results['scenarios'][name] = run_query(blog, retriever, args.concurrency, args.queries,
+                                                           args.cached)
+                elif name == 'sync':
+                    retriever.s3_upload = upload
+                    results['scenarios'][name] = run_sync(blog, retriever)
+                elif name == 'rerank':
+                    results['scenarios'][name] = run_rerank()
+        results['peak_rss_mb'] = peak_rss_mb()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    # Usage: python benchmark.py --posts 2000 --concurrency 16 --output baseline.json
+    #        python benchmark.py --baseline baseline.json [--profile cprofile|py-spy]
+    main()
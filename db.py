@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager, closing
+from mysql.connector import Error
+from mysql.connector.pooling import MySQLConnectionPool
+
+# Connection settings for the blog database
+DB_HOST = os.environ.get('AUTOBLOG_BLOG_DB')
+DB_NAME = os.environ.get('AUTOBLOG_BLOG_DB_NAME', 'blog')
+DB_USER = os.environ.get('AUTOBLOG_BLOG_DB_USER', 'wp_rw')
+DB_PASSWORD = os.environ.get('AUTOBLOG_BLOG_RW_PASSWORD')
+DB_PORT = int(os.environ.get('AUTOBLOG_BLOG_DB_PORT', 3306))
+DB_POOL_SIZE = int(os.environ.get('AUTOBLOG_BLOG_DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('AUTOBLOG_BLOG_DB_POOL_TIMEOUT', 10))
+
+_pool = None
+_pool_lock = threading.Lock()
+# mysql-connector raises as soon as the pool is exhausted, so callers queue on this semaphore instead
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+_stats_lock = threading.Lock()
+_stats = {
+    'checkouts': 0,
+    'in_use': 0,
+    'max_in_use': 0,
+    'reconnects': 0,
+    'timeouts': 0,
+    'wait_seconds_total': 0.0,
+    'wait_seconds_max': 0.0,
+}
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = MySQLConnectionPool(pool_name='autoblog_blog', pool_size=DB_POOL_SIZE,
+                                            pool_reset_session=True, host=DB_HOST, database=DB_NAME,
+                                            user=DB_USER, password=DB_PASSWORD, port=DB_PORT)
+                logging.info(f"MySQL connection pool created with size {DB_POOL_SIZE}")
+    return _pool
+
+
+def _record_checkout(wait_seconds):
+    with _stats_lock:
+        _stats['checkouts'] += 1
+        _stats['in_use'] += 1
+        _stats['max_in_use'] = max(_stats['max_in_use'], _stats['in_use'])
+        _stats['wait_seconds_total'] += wait_seconds
+        _stats['wait_seconds_max'] = max(_stats['wait_seconds_max'], wait_seconds)
+
+
+def _record_release():
+    with _stats_lock:
+        _stats['in_use'] -= 1
+
+
+@contextmanager
+def get_connection():
+    """Borrow a health-checked connection from the pool, returning it when the block exits."""
+    started = time.monotonic()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _stats_lock:
+            _stats['timeouts'] += 1
+        raise Error(msg=f"Timed out after {DB_POOL_TIMEOUT}s waiting for a MySQL connection")
+    try:
+        connection = _get_pool().get_connection()
+    except Exception:
+        _pool_slots.release()
+        raise
+    _record_checkout(time.monotonic() - started)
+    try:
+        if not connection.is_connected():
+            with _stats_lock:
+                _stats['reconnects'] += 1
+            connection.reconnect(attempts=3, delay=1)
+        yield connection
+    finally:
+        # Closing a pooled connection hands it back to the pool
+        connection.close()
+        _record_release()
+        _pool_slots.release()
+
+
+def _decode(value):
+    # Prepared cursors may hand back text columns as raw bytes
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8')
+    return value
+
+
+def fetch_one(sql_query, params=()):
+    with get_connection() as connection:
+        with closing(connection.cursor(prepared=True)) as cursor:
+            cursor.execute(sql_query, params)
+            row = cursor.fetchone()
+    return tuple(_decode(v) for v in row) if row else None
+
+
+def fetch_all(sql_query, params=()):
+    with get_connection() as connection:
+        with closing(connection.cursor(prepared=True)) as cursor:
+            cursor.execute(sql_query, params)
+            rows = cursor.fetchall()
+    return [tuple(_decode(v) for v in row) for row in rows]
+
+
+def fetch_post_content(post_id):
+    row = fetch_one("SELECT post_content FROM wp_posts WHERE id = %s", (int(post_id),))
+    return row[0] if row else None
+
+
+def fetch_post_contents(post_ids):
+    """Fetch post_content for many posts in a single query, keyed by post id."""
+    post_ids = [int(post_id) for post_id in post_ids]
+    if not post_ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    rows = fetch_all(f"SELECT id, post_content FROM wp_posts WHERE id IN ({placeholders})", tuple(post_ids))
+    return {str(post_id): post_content for post_id, post_content in rows}
+
+
+def get_pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['pool_size'] = DB_POOL_SIZE
+    stats['wait_seconds_avg'] = stats['wait_seconds_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+    return stats
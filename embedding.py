@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from retry import is_retryable, retry_after
+
+# Embedding pipeline settings for collection rebuilds
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 100))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', 250000))
+EMBEDDING_WORKERS = int(os.environ.get('EMBEDDING_WORKERS', 4))
+EMBEDDING_MAX_RETRIES = int(os.environ.get('EMBEDDING_MAX_RETRIES', 6))
+EMBEDDING_BACKOFF_BASE = float(os.environ.get('EMBEDDING_BACKOFF_BASE', 1.0))
+EMBEDDING_BACKOFF_MAX = float(os.environ.get('EMBEDDING_BACKOFF_MAX', 60.0))
+EMBEDDING_CHECKPOINT_PATH = os.environ.get('EMBEDDING_CHECKPOINT_PATH', '/tmp/embedding_checkpoint.jsonl')
+LOCAL_EMBEDDING_DIMENSIONS = int(os.environ.get('LOCAL_EMBEDDING_DIMENSIONS', 384))
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_batches(ids, documents, batch_size=EMBEDDING_BATCH_SIZE, batch_tokens=EMBEDDING_BATCH_TOKENS):
+    """Group (id, document) pairs into batches bounded by both item count and estimated tokens."""
+    batch, tokens = [], 0
+    for post_id, document in zip(ids, documents):
+        document_tokens = estimate_tokens(document)
+        if batch and (len(batch) >= batch_size or tokens + document_tokens > batch_tokens):
+            yield batch
+            batch, tokens = [], 0
+        batch.append((post_id, document))
+        tokens += document_tokens
+    if batch:
+        yield batch
+
+
+def embed_with_retry(embedding_function, texts, max_retries=EMBEDDING_MAX_RETRIES):
+    for attempt in range(max_retries + 1):
+        try:
+            return [list(embedding) for embedding in embedding_function(texts)]
+        except Exception as e:
+            # Invalid input and other permanent errors fail the rebuild straight away instead of after every backoff
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = min(EMBEDDING_BACKOFF_MAX, EMBEDDING_BACKOFF_BASE * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+            logging.warning(f"Embedding batch of {len(texts)} failed ({e}); retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class EmbeddingCheckpoint:
+    """Append-only record of finished embeddings so an interrupted rebuild can resume.
+
+    The file is scanned once to index the byte offset of each (id, hash); a batch then reads back only its own records.
+    """
+
+    def __init__(self, path=EMBEDDING_CHECKPOINT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets = None
+
+    def _index(self):
+        with self._lock:
+            if self._offsets is None:
+                self._offsets = {}
+                if self.path and os.path.exists(self.path):
+                    offset = 0
+                    with open(self.path, 'rb+') as f:
+                        for line in f:
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                # A torn final line from a crash mid-write; drop it so new records start cleanly
+                                f.truncate(offset)
+                                break
+                            self._offsets[(record['id'], record['hash'])] = offset
+                            offset += len(line)
+            return self._offsets
+
+    def lookup(self, keys):
+        """Return the checkpointed embedding for each (id, hash) key that has one."""
+        offsets = self._index()
+        wanted = sorted((offsets[key], key) for key in keys if key in offsets)
+        found = {}
+        if wanted:
+            with open(self.path, 'rb') as f:
+                for offset, key in wanted:
+                    f.seek(offset)
+                    found[key] = json.loads(f.readline())['embedding']
+        return found
+
+    def append(self, batch, embeddings):
+        if not self.path:
+            return
+        with self._lock, open(self.path, 'a') as f:
+            for (post_id, document), embedding in zip(batch, embeddings):
+                f.write(json.dumps({'id': post_id, 'hash': text_hash(document), 'embedding': embedding}) + '\n')
+
+    def clear(self):
+        with self._lock:
+            self._offsets = None
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def embed_documents(ids, documents, embedding_function, checkpoint=None, max_workers=EMBEDDING_WORKERS):
+    """Embed documents in bounded, concurrently submitted batches, reusing checkpointed results.
+
+    Returns embeddings in the same order as `documents`.
+    """
+    checkpoint = checkpoint or EmbeddingCheckpoint()
+    keys = [(post_id, text_hash(document)) for post_id, document in zip(ids, documents)]
+    done = checkpoint.lookup(keys)
+    embeddings = {}
+    pending_ids, pending_documents = [], []
+    for (post_id, document_hash), document in zip(keys, documents):
+        embedding = done.get((post_id, document_hash))
+        if embedding is not None:
+            embeddings[post_id] = embedding
+        else:
+            pending_ids.append(post_id)
+            pending_documents.append(document)
+    if embeddings:
+        logging.info(f"Resuming embedding from checkpoint: {len(embeddings)} reused, {len(pending_ids)} pending")
+
+    batches = list(make_batches(pending_ids, pending_documents))
+    completed = 0
+    failure = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(embed_with_retry, embedding_function, [d for _, d in batch]): batch
+                   for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_embeddings = future.result()
+            except Exception as e:
+                # Keep checkpointing the batches that do succeed so the next attempt resumes from there
+                failure = failure or e
+                continue
+            checkpoint.append(batch, batch_embeddings)
+            for (post_id, _), embedding in zip(batch, batch_embeddings):
+                embeddings[post_id] = embedding
+            completed += 1
+            logging.info(f"Embedded batch {completed}/{len(batches)} ({len(batch)} documents)")
+
+    if failure:
+        raise failure
+    return [embeddings[post_id] for post_id in ids]
+
+
+class HashingEmbeddingFunction:
+    """Deterministic offline embeddings for tests and benchmarks: signed feature hashing of words and word pairs.
+
+    Texts that share vocabulary land close together, so retrieval quality is plausible without any network call.
+    """
+
+    def __init__(self, dimensions=LOCAL_EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = text.split()
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    # Chroma requires this exact signature for embedding functions
+    def __call__(self, input):
+        return [self.embed(text) for text in input]
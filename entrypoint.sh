@@ -14,7 +14,8 @@ fi
 
 
 echo "Copying data from S3 to local directory..."
-aws s3 cp --recursive s3://autoblog-ai-${ENV}-${AWS_REGION}/chromadb chromadb --sse AES256
+python recommendation-engine/snapshot.py download autoblog-ai-${ENV}-${AWS_REGION} chromadb/ chromadb
+COPY_RESULT=$?
 
 if [[ $COPY_RESULT -ne 0 ]]; then
   echo "Failed to copy data from S3"
@@ -23,13 +24,29 @@ fi
 
 echo "Data copied successfully"
 
+RETRIEVER_THREADS=${RETRIEVER_THREADS:-16}
+GENERATOR_WORKERS=${GENERATOR_WORKERS:-2}
+GENERATOR_THREADS=${GENERATOR_THREADS:-8}
+GRACEFUL_TIMEOUT=${GRACEFUL_TIMEOUT:-30}
+
 # Start the first application on port 8080
+# The Retriever runs in a single worker: only the scheduler process swaps in new collection generations,
+# and the Chroma PersistentClient cannot be shared between processes
 echo "Starting recommendation-engine/retriever.py on port 8080..."
-python recommendation-engine/retriever.py &
+ENABLE_SCHEDULER=true gunicorn --chdir recommendation-engine --bind 0.0.0.0:8080 --worker-class gthread \
+  --workers 1 --threads "$RETRIEVER_THREADS" \
+  --graceful-timeout "$GRACEFUL_TIMEOUT" --timeout 120 'retriever:create_app()' &
+RETRIEVER_PID=$!
 
 # Start the Flask application on port 8081
 echo "Starting image-analysis-engine/generator.py on port 8081..."
-python image-analysis-engine/generator.py &
+gunicorn --chdir image-analysis-engine --bind 0.0.0.0:8081 --worker-class gthread \
+  --workers "$GENERATOR_WORKERS" --threads "$GENERATOR_THREADS" \
+  --graceful-timeout "$GRACEFUL_TIMEOUT" --timeout 120 'generator:create_app()' &
+GENERATOR_PID=$!
+
+# Forward SIGTERM so both servers finish in-flight requests before the container stops
+trap 'kill -TERM $RETRIEVER_PID $GENERATOR_PID; wait' TERM INT
 
-# Keep the container running indefinitely
-tail -f /dev/null
+# Keep the container running while both servers are up
+wait -n
@@ -1,7 +1,15 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import logging
-from flask import Flask, request, jsonify
+import hashlib
+import json
+import queue
+import random
+import asyncio
+import threading
+from flask import Flask, request, jsonify, Response
 import os
+from cache import SQLiteCache, SingleFlight
+from retry import is_retryable, retry_after
 
 app = Flask(__name__)
 
@@ -12,42 +20,95 @@ client = OpenAI(api_key=os.environ.get('GPT_API_KEY'))
 logging.basicConfig(filename='image_analysis.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = ("You are an assistant that generates descriptive alt text for images. "
+                 "Follow SEO guidelines for alt text generation. "
+                 "Keep your alt text fewer than 100 characters.")
+USER_PROMPT = ("Generate a descriptive alt text for the following image {title}. "
+               "Use the file name if it is appropriate. "
+               "Keep your alt text fewer than 100 characters. "
+               "Follow SEO guidelines for alt text generation. "
+               "If the image contains car, include the color of the car and view of the car in the alt text. "
+               "Here is the image url:")
+# Changes whenever the model or prompts change, so answers produced by an older prompt are never served
+PROMPT_VERSION = hashlib.sha256(f"{MODEL}\n{SYSTEM_PROMPT}\n{USER_PROMPT}".encode('utf-8')).hexdigest()[:16]
+
+# With temperature=0 the answer for an image is deterministic, so it is cached on disk for every worker
+ALT_TEXT_CACHE_PATH = os.environ.get('ALT_TEXT_CACHE_PATH', '/tmp/alt_text_cache.sqlite3')
+ALT_TEXT_CACHE_SIZE = int(os.environ.get('ALT_TEXT_CACHE_SIZE', 100000))
+ALT_TEXT_CACHE_TTL = int(os.environ.get('ALT_TEXT_CACHE_TTL', 30 * 24 * 3600))
+alt_text_cache = SQLiteCache(ALT_TEXT_CACHE_PATH, maxsize=ALT_TEXT_CACHE_SIZE, ttl=ALT_TEXT_CACHE_TTL)
+# Concurrent requests for the same image in this process share one upstream call
+alt_text_calls = SingleFlight()
+
+# Bulk generation settings
+ALT_TEXT_CONCURRENCY = int(os.environ.get('ALT_TEXT_CONCURRENCY', 16))
+ALT_TEXT_TIMEOUT = float(os.environ.get('ALT_TEXT_TIMEOUT', 60))
+ALT_TEXT_MAX_RETRIES = int(os.environ.get('ALT_TEXT_MAX_RETRIES', 4))
+ALT_TEXT_BACKOFF_BASE = float(os.environ.get('ALT_TEXT_BACKOFF_BASE', 1.0))
+ALT_TEXT_BACKOFF_MAX = float(os.environ.get('ALT_TEXT_BACKOFF_MAX', 30.0))
+MAX_BULK_IMAGES = int(os.environ.get('MAX_BULK_IMAGES', 5000))
+
+# One event loop thread per worker process runs every bulk request's upstream calls
+event_loop = None
+async_client = None
+event_loop_lock = threading.Lock()
+
+
+def alt_text_cache_key(image_url, image_title=None):
+    return hashlib.sha256(json.dumps([image_url, image_title or '', PROMPT_VERSION]).encode('utf-8')).hexdigest()
+
 
 def get_alt_text(image_url, image_title=None):
+    key = alt_text_cache_key(image_url, image_title)
+    alt_text = alt_text_cache.get(key)
+    if alt_text is not None:
+        logging.info(f"Alt text cache hit for image URL: {image_url}")
+        return alt_text
+    return alt_text_calls.do(key, generate_and_cache_alt_text, key, image_url, image_title)
+
+
+def generate_and_cache_alt_text(key, image_url, image_title=None):
+    # Another request may have stored the answer while this one waited to become the leader
+    alt_text = alt_text_cache.get(key)
+    if alt_text is None:
+        alt_text = request_alt_text(image_url, image_title)
+        alt_text_cache.set(key, alt_text)
+    return alt_text
+
+
+def build_messages(image_url, image_title=None):
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": USER_PROMPT.format(
+                    title='titled ' + image_title if image_title else '')},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url,
+                    },
+                },
+            ],
+        }
+    ]
+
+
+def request_alt_text(image_url, image_title=None):
     # Log the request
     logging.info(f"Generating alt text for image URL: {image_url} with title: {image_title}")
 
     # Create the chat completion request
     try:
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an assistant that generates descriptive alt text for images. "
-                           "Follow SEO guidelines for alt text generation. "
-                           "Keep your alt text fewer than 100 characters."
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": f"Generate a descriptive alt text for the following image "
-                                             f"{'titled ' + image_title if image_title else ''}. "
-                                             f"Use the file name if it is appropriate. "
-                                             f"Keep your alt text fewer than 100 characters. "
-                                             f"Follow SEO guidelines for alt text generation. "
-                                             f"If the image contains car, include the color of the car and view of the car in the alt text. "
-                                             f"Here is the image url:"},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_url,
-                        },
-                    },
-                ],
-            }
-        ]
+        messages = build_messages(image_url, image_title)
 
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=MODEL,
             messages=messages,
             max_tokens=300,
             temperature=0,
@@ -81,6 +142,115 @@ def generate_alt_text():
         return jsonify({"error": str(e)}), 500
 
 
+def get_event_loop():
+    global event_loop, async_client
+    with event_loop_lock:
+        if event_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='alt-text-event-loop', daemon=True).start()
+            # Retries are handled in request_alt_text_async so backoff is jittered and timeouts are per attempt
+            async_client = AsyncOpenAI(api_key=os.environ.get('GPT_API_KEY'), max_retries=0)
+            event_loop = loop
+    return event_loop
+
+
+async def request_alt_text_async(image_url, image_title=None):
+    for attempt in range(ALT_TEXT_MAX_RETRIES + 1):
+        try:
+            response = await asyncio.wait_for(async_client.chat.completions.create(
+                model=MODEL,
+                messages=build_messages(image_url, image_title),
+                max_tokens=300,
+                temperature=0,
+                top_p=1,
+            ), ALT_TEXT_TIMEOUT)
+            return response.choices[0].message.content
+        except Exception as e:
+            if attempt == ALT_TEXT_MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                delay = min(ALT_TEXT_BACKOFF_MAX, ALT_TEXT_BACKOFF_BASE * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+            logging.warning(f"Alt text request for {image_url} failed ({e!r}); retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def generate_alt_texts(images, emit, concurrency=ALT_TEXT_CONCURRENCY):
+    """Generate alt text for (image_url, image_title) pairs, calling emit with each result as it completes."""
+    semaphore = asyncio.Semaphore(concurrency)
+    # Repeated images in one request share a single task
+    tasks = {}
+
+    async def generate(key, image_url, image_title):
+        # The SQLite cache can wait on another worker's write lock, so keep it off the shared event loop
+        alt_text = await asyncio.to_thread(alt_text_cache.get, key)
+        if alt_text is not None:
+            return alt_text
+        async with semaphore:
+            alt_text = await request_alt_text_async(image_url, image_title)
+        await asyncio.to_thread(alt_text_cache.set, key, alt_text)
+        return alt_text
+
+    async def generate_one(index, image_url, image_title):
+        key = alt_text_cache_key(image_url, image_title)
+        if key not in tasks:
+            tasks[key] = asyncio.ensure_future(generate(key, image_url, image_title))
+        try:
+            emit({"index": index, "image_url": image_url, "alt_text": await asyncio.shield(tasks[key])})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Error generating alt text for image URL {image_url}: {e}")
+            emit({"index": index, "image_url": image_url, "error": str(e)})
+
+    try:
+        await asyncio.gather(*(generate_one(index, image_url, image_title)
+                               for index, (image_url, image_title) in enumerate(images)))
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+@app.route('/generate-alt-text/batch', methods=['POST'])
+def generate_alt_text_batch():
+    images = (request.get_json(silent=True) or {}).get('images')
+    if not isinstance(images, list) or not images:
+        return jsonify({"error": "images must be a non-empty list"}), 400
+    if len(images) > MAX_BULK_IMAGES:
+        return jsonify({"error": f"At most {MAX_BULK_IMAGES} images per request"}), 400
+    pairs = []
+    for image in images:
+        if not isinstance(image, dict) or not image.get('image_url'):
+            return jsonify({"error": "Every image needs an image_url"}), 400
+        image_title = image.get('image_title')
+        pairs.append((image['image_url'], image_title if image_title and image_title != 'undefined' else None))
+
+    logging.info(f"Generating alt text for {len(pairs)} images")
+    results = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(generate_alt_texts(pairs, results.put), get_event_loop())
+    # None marks the end of the stream, even if the whole batch fails
+    future.add_done_callback(lambda f: results.put(None))
+
+    def stream():
+        try:
+            while True:
+                result = results.get()
+                if result is None:
+                    break
+                yield json.dumps(result) + '\n'
+        finally:
+            # Stops outstanding upstream calls when the client disconnects
+            future.cancel()
+
+    return Response(stream(), mimetype='application/x-ndjson')
+
+
+# App factory for WSGI servers, e.g. gunicorn 'generator:create_app()'
+def create_app():
+    return app
+
+
 if __name__ == "__main__":
     logging.info("Starting Flask server")
-    app.run(host='0.0.0.0', port=8081, debug=True)
+    app.run(host='0.0.0.0', port=8081, debug=os.environ.get('FLASK_DEBUG') == '1')
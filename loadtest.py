@@ -0,0 +1,67 @@
+import sys
+import time
+import json
+import argparse
+import threading
+import urllib.request
+from urllib.error import URLError
+
+from metrics import bucket_index, percentiles
+
+
+# Function to hammer one URL from several threads and report throughput and latency percentiles
+def run(url, concurrency, duration, timeout):
+    deadline = time.monotonic() + duration
+    lock = threading.Lock()
+    histogram = {}
+    counts = {'ok': 0, 'errors': 0}
+
+    def worker():
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                ok = True
+            except (URLError, OSError):
+                ok = False
+            micros = int((time.perf_counter() - started) * 1000000)
+            with lock:
+                counts['ok' if ok else 'errors'] += 1
+                index = bucket_index(micros)
+                histogram[index] = histogram.get(index, 0) + 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latency = percentiles(histogram)
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': counts['ok'] + counts['errors'],
+        'errors': counts['errors'],
+        'throughput_rps': round((counts['ok'] + counts['errors']) / elapsed, 1),
+        'p50_ms': round(latency.get(50, 0) / 1000, 2),
+        'p90_ms': round(latency.get(90, 0) / 1000, 2),
+        'p99_ms': round(latency.get(99, 0) / 1000, 2),
+    }
+
+
+if __name__ == '__main__':
+    # Usage: python loadtest.py "http://localhost:8080/api/results?post_content_id=123" -c 16 -d 30
+    parser = argparse.ArgumentParser(description='Simple load test for the recommendation and image analysis APIs')
+    parser.add_argument('url')
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-d', '--duration', type=float, default=30)
+    parser.add_argument('-t', '--timeout', type=float, default=30)
+    args = parser.parse_args()
+    report = run(args.url, args.concurrency, args.duration, args.timeout)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    sys.exit(1 if report['errors'] else 0)
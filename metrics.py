@@ -0,0 +1,222 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 60))
+
+# Histogram buckets keep 16 linear sub-buckets per power of two of microseconds, about 6% relative error
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+PERCENTILES = (50, 90, 99)
+
+
+def bucket_index(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index):
+    # Midpoint of the range of values that fall into the bucket
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index - shift * SUB_BUCKETS) << shift) + (1 << shift) // 2
+
+
+def percentiles(buckets, wanted=PERCENTILES):
+    total = sum(buckets.values())
+    results = {}
+    if not total:
+        return results
+    ordered = sorted(buckets.items())
+    for percentile in wanted:
+        threshold = total * percentile / 100
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen >= threshold:
+                results[percentile] = bucket_value(index)
+                break
+    return results
+
+
+class _Shard:
+    """Counters and histograms written only by the thread that owns them."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+
+class MetricsRegistry:
+    """Counters and latency histograms sharded per thread, so recording never takes a lock.
+
+    Values only ever grow; the flusher reports the difference from its previous read.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._flushed_counters = {}
+        self._flushed_histograms = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            # Only taken once per thread
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def increment(self, name, value=1):
+        counters = self._shard().counters
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        histogram = self._shard().histograms.setdefault(name, {})
+        index = bucket_index(int(seconds * 1000000))
+        histogram[index] = histogram.get(index, 0) + 1
+
+    @contextmanager
+    def timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def _totals(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        counters, histograms = {}, {}
+        for shard in shards:
+            for name, value in list(shard.counters.items()):
+                counters[name] = counters.get(name, 0) + value
+            for name, histogram in list(shard.histograms.items()):
+                merged = histograms.setdefault(name, {})
+                for index, count in list(histogram.items()):
+                    merged[index] = merged.get(index, 0) + count
+        return counters, histograms
+
+    def pending(self):
+        """Return (collected, totals): the metrics recorded since the last commit() as a flat name -> number dict,
+        and the totals to pass to commit() once they have been sent."""
+        counters, histograms = self._totals()
+        collected = {}
+        for name, value in counters.items():
+            delta = value - self._flushed_counters.get(name, 0)
+            if delta:
+                collected[name] = delta
+        for name, histogram in histograms.items():
+            previous = self._flushed_histograms.get(name, {})
+            delta = {index: count - previous.get(index, 0) for index, count in histogram.items()
+                     if count - previous.get(index, 0)}
+            if delta:
+                collected[f"{name}_count"] = sum(delta.values())
+                for percentile, micros in percentiles(delta).items():
+                    collected[f"{name}_ms_p{percentile}"] = round(micros / 1000, 3)
+        return collected, (counters, histograms)
+
+    def commit(self, totals):
+        """Move the baseline of pending() forward, so the metrics sent with these totals are not reported again."""
+        self._flushed_counters, self._flushed_histograms = totals
+
+    def collect(self):
+        """Return the metrics recorded since the previous collect() and commit them straight away."""
+        collected, totals = self.pending()
+        self.commit(totals)
+        return collected
+
+
+class LocalSink:
+    """Keeps every flushed batch in memory, for tests and local runs."""
+
+    def __init__(self):
+        self.batches = []
+
+    def send(self, collected):
+        self.batches.append(collected)
+
+
+class LoggingSink:
+    def send(self, collected):
+        logging.info(f"Metrics: {collected}")
+
+
+class YamasSink:
+    def __init__(self, application='autoblog'):
+        self.application = application
+        self.yamas_api = None
+
+    def send(self, collected):
+        from ouroath.yamas.collector.api import YamasCollectorAPI
+        from ouroath.yamas.collector.endpoints import PUBLIC
+        from ouroath.yamas.collector.message import YamasMessage
+        if self.yamas_api is None:
+            self.yamas_api = YamasCollectorAPI(
+                namespace=os.environ.get('YAMAS_NAMESPACE'),
+                endpoint=PUBLIC,
+                key_path=os.environ.get('SIA_KEY_PATH'),
+                cert_path=os.environ.get('SIA_CERT_PATH')
+            )
+        self.yamas_api.send_message(YamasMessage(application=self.application, metrics=collected))
+
+
+class MetricsFlusher(threading.Thread):
+    """Single background thread that sends collected metrics to a sink every interval."""
+
+    def __init__(self, metrics_registry, sink, interval=METRICS_FLUSH_INTERVAL):
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.registry = metrics_registry
+        self.sink = sink
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._flush_lock = threading.Lock()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        # stop() can flush while the thread is mid-flush, and the same interval must not be sent twice
+        with self._flush_lock:
+            try:
+                collected, totals = self.registry.pending()
+                if collected:
+                    logging.info("Sending aggregated metrics")
+                    self.sink.send(collected)
+                    logging.info("Aggregated metrics sent successfully")
+                # Committed only after a successful send, so a failed interval is sent again with the next one
+                self.registry.commit(totals)
+            except Exception as e:
+                logging.error(f"Error sending aggregated metrics: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+
+registry = MetricsRegistry()
+increment = registry.increment
+observe = registry.observe
+timed = registry.timed
+_flusher = None
+
+
+def start_flusher(sink, interval=METRICS_FLUSH_INTERVAL):
+    global _flusher
+    if _flusher is None or not _flusher.is_alive():
+        _flusher = MetricsFlusher(registry, sink, interval)
+        _flusher.start()
+    return _flusher
+
+
+def stop_flusher():
+    if _flusher is not None:
+        _flusher.stop()
@@ -0,0 +1,112 @@
+import os
+import re
+import html.entities
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+PREPROCESS_CHUNKSIZE = 32
+
+URL_PATTERN = re.compile(r'http\S+')
+SPECIAL_CHARS_PATTERN = re.compile(r'[^a-zA-Z0-9\s$]+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Elements whose contents BeautifulSoup's get_text() leaves out
+SKIPPED_TAGS = {'script', 'style', 'template'}
+
+# Named references BeautifulSoup resolves, with or without their semicolon
+ENTITIES = {name.rstrip(';'): character for name, character in html.entities.html5.items()}
+
+
+class TextExtractor(HTMLParser):
+    """Streaming tag stripper that keeps the same text nodes as BeautifulSoup(text, 'html.parser').get_text().
+
+    References are resolved the way BeautifulSoup's html.parser builder does, not by convert_charrefs.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def handle_charref(self, name):
+        code_point = int(name[1:], 16) if name[:1] in 'xX' else int(name)
+        character = None
+        if code_point < 256:
+            # Low references are often meant as Windows-1252, e.g. &#147; for a left double quote
+            try:
+                character = bytes([code_point]).decode('windows-1252')
+            except UnicodeDecodeError:
+                pass
+        if not character:
+            try:
+                character = chr(code_point)
+            except (ValueError, OverflowError):
+                pass
+        self.handle_data(character or '\N{REPLACEMENT CHARACTER}')
+
+    def handle_entityref(self, name):
+        # Unknown names, such as query string parameters, stay literal
+        self.handle_data(ENTITIES.get(name, f'&{name}'))
+
+    def unknown_decl(self, data):
+        # CDATA sections are kept as text
+        if data.upper().startswith('CDATA['):
+            self.handle_data(data[6:])
+
+
+def strip_html(text):
+    # Plain text needs no parsing at all
+    if '<' not in text and '&' not in text:
+        return text
+    extractor = TextExtractor()
+    extractor.feed(text)
+    extractor.close()
+    return ''.join(extractor.parts)
+
+
+# Preprocess text content
+def preprocess_text(text):
+    # Remove HTML tags
+    text = strip_html(text)
+
+    # Lowercasing
+    text = text.lower()
+
+    # Remove URLs
+    text = URL_PATTERN.sub('', text)
+
+    # Remove special characters and punctuation
+    text = SPECIAL_CHARS_PATTERN.sub('', text)
+
+    # Remove extra whitespace
+    text = WHITESPACE_PATTERN.sub(' ', text).strip()
+
+    return text
+
+
+def create_preprocess_executor(workers=PREPROCESS_WORKERS):
+    # Spawned workers only import this module, so they start fast and never inherit server threads
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+# Preprocess many posts at once, across a process pool when one is given
+def preprocess_texts(texts, executor=None, chunksize=PREPROCESS_CHUNKSIZE):
+    if executor is None or len(texts) < chunksize:
+        return [preprocess_text(text) for text in texts]
+    return list(executor.map(preprocess_text, texts, chunksize=chunksize))
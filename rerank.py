@@ -0,0 +1,55 @@
+import os
+import time
+import numpy as np
+
+# Candidates fetched per query before reranking, and the default reranking weights
+RERANK_CANDIDATES = int(os.environ.get('RERANK_CANDIDATES', 100))
+RERANK_RECENCY_WEIGHT = float(os.environ.get('RERANK_RECENCY_WEIGHT', 0.2))
+RERANK_HALF_LIFE_DAYS = float(os.environ.get('RERANK_HALF_LIFE_DAYS', 180))
+RERANK_DIVERSITY = float(os.environ.get('RERANK_DIVERSITY', 0.3))
+DEFAULT_WEIGHTS = {
+    'recency_weight': RERANK_RECENCY_WEIGHT,
+    'half_life_days': RERANK_HALF_LIFE_DAYS,
+    'diversity': RERANK_DIVERSITY,
+}
+SECONDS_PER_DAY = 86400
+
+
+# Function to check whether a set of weights changes the nearest-neighbour order at all
+def is_enabled(weights):
+    return weights['recency_weight'] > 0 or weights['diversity'] > 0
+
+
+def rerank(similarities, embeddings, timestamps, nresults, recency_weight=RERANK_RECENCY_WEIGHT,
+           half_life_days=RERANK_HALF_LIFE_DAYS, diversity=RERANK_DIVERSITY, now=None):
+    """Return the positions of the nresults candidates picked by recency-weighted MMR, best first.
+
+    Relevance blends query similarity with an exponential recency decay; MMR then trades relevance off
+    against the highest similarity to any candidate already picked.
+    """
+    similarities = np.asarray(similarities, dtype=np.float32)
+    count = len(similarities)
+    nresults = min(nresults, count)
+    if nresults <= 0:
+        return []
+    now = time.time() if now is None else now
+
+    ages = np.maximum(now - np.asarray(timestamps, dtype=np.float64), 0) / SECONDS_PER_DAY
+    decay = np.exp2(-ages / half_life_days).astype(np.float32) if half_life_days > 0 else np.ones(count, np.float32)
+    relevance = (1 - recency_weight) * similarities + recency_weight * decay
+    if diversity <= 0:
+        return np.argsort(-relevance, kind='stable')[:nresults].tolist()
+
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    picked = []
+    for _ in range(nresults):
+        scores = (1 - diversity) * relevance - diversity * np.maximum(redundancy, 0)
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        # Only the similarities to picked candidates are needed, one matrix-vector product per pick
+        np.maximum(redundancy, embeddings @ embeddings[best], out=redundancy)
+    return picked
@@ -1,40 +1,224 @@
 import os
+import re
+import hashlib
 import shutil
 import logging
 import threading
-from contextlib import closing
+import fcntl
+import atexit
 from datetime import timedelta, datetime
-import re
-from bs4 import BeautifulSoup
 from flask import Flask, jsonify, request
-from mysql.connector import connect, Error
-import chromadb
-from chromadb.utils import embedding_functions
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import boto3
-from botocore.exceptions import NoCredentialsError
-from ouroath.yamas.collector.api import YamasCollectorAPI
-from ouroath.yamas.collector.endpoints import PUBLIC
-from ouroath.yamas.collector.exceptions import YamasError
-from ouroath.yamas.collector.message import YamasMessage
-from apscheduler.schedulers.background import BackgroundScheduler
+from mysql.connector import Error
 import time
+from cache import TTLCache
+import db
+import metrics
+from embedding import EmbeddingCheckpoint, HashingEmbeddingFunction, embed_documents, embed_with_retry, make_batches
+import vector_index
+from vector_index import pool_embeddings
+import rerank
+from preprocess import preprocess_text, preprocess_texts, create_preprocess_executor
 
 logging.basicConfig(filename='api_results.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Process start, for reporting time-to-ready
+STARTED_AT = time.monotonic()
+
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize variables for metric aggregation
-metrics = {}
-timer = None
+CHUNK_SIZE = 8000
+CHROMA_PATH = os.environ.get('CHROMA_PATH', '/app/chromadb')
+
+# 'local' swaps OpenAI for deterministic offline embeddings, so retrieval can be benchmarked without network access
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'openai')
+
+# Heavy clients are created on first use, so importing this module stays cheap
+client = None
+embedding_function = None
+text_splitter = None
+init_lock = threading.Lock()
+
+# Rebuilds and syncs write a new embedded_posts_<timestamp> generation and swap it in once verified
+COLLECTION_NAME = "embedded_posts"
+COLLECTION_GENERATIONS_KEPT = int(os.environ.get('CHROMA_GENERATIONS_KEPT', 2))
+collection_lock = threading.Lock()
+collection = None
+search_index = None
+ready_seconds = None
 
-# Initialize ChromaDB client and text splitter
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=0)
-client = chromadb.PersistentClient(path="/app/chromadb")
-openai_ef = embedding_functions.OpenAIEmbeddingFunction(api_key=os.environ.get('GPT_API_KEY'),
-                                                        model_name="text-embedding-3-small")
-collection = client.get_or_create_collection(name="embedded_posts", embedding_function=openai_ef)
+
+# Function to create the Chroma client once per process
+def get_client():
+    global client
+    if client is None:
+        with init_lock:
+            if client is None:
+                import chromadb
+                client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return client
+
+
+# Function to create the configured embedding function once per process
+def get_embedding_function():
+    global embedding_function
+    if embedding_function is None:
+        with init_lock:
+            if embedding_function is None:
+                if EMBEDDING_BACKEND == 'local':
+                    embedding_function = HashingEmbeddingFunction()
+                else:
+                    from chromadb.utils import embedding_functions
+                    embedding_function = embedding_functions.OpenAIEmbeddingFunction(
+                        api_key=os.environ.get('GPT_API_KEY'), model_name="text-embedding-3-small")
+    return embedding_function
+
+
+# Function to create a text splitter; only posts that are embedded need one
+def create_text_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=0)
+
+
+def get_text_splitter():
+    global text_splitter
+    if text_splitter is None:
+        with init_lock:
+            if text_splitter is None:
+                text_splitter = create_text_splitter()
+    return text_splitter
+
+
+# Function to list collection generations from oldest to newest
+def list_collection_generations(target_client):
+    names = [getattr(c, 'name', c) for c in target_client.list_collections()]
+    return sorted(name for name in names if name == COLLECTION_NAME or name.startswith(COLLECTION_NAME + '_'))
+
+
+# Function to open the newest collection generation
+def get_serving_collection(target_client):
+    generations = list_collection_generations(target_client)
+    name = generations[-1] if generations else COLLECTION_NAME
+    return target_client.get_or_create_collection(name=name, embedding_function=get_embedding_function())
+
+
+# 'numpy' serves queries from an in-process index memory-mapped from the Chroma directory; 'chroma' queries Chroma
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'chroma')
+VECTOR_INDEX_PATH = os.environ.get('VECTOR_INDEX_PATH', os.path.join(CHROMA_PATH, 'vector_index'))
+
+
+# Function to open the configured vector backend over a collection generation
+def open_vector_index(target_collection):
+    if VECTOR_BACKEND == 'numpy':
+        return vector_index.open_numpy_index(target_collection, VECTOR_INDEX_PATH)
+    return vector_index.ChromaIndex(target_collection)
+
+
+# Function to open the serving collection and its vector index once per process
+def load_index():
+    global collection, search_index, ready_seconds
+    if search_index is None:
+        with collection_lock:
+            if search_index is None:
+                collection = get_serving_collection(get_client())
+                search_index = open_vector_index(collection)
+                ready_seconds = time.monotonic() - STARTED_AT
+                metrics.observe('startup_ready', ready_seconds)
+                logging.info(f"Serving index {collection.name} loaded, ready {ready_seconds:.2f}s after start")
+    return search_index
+
+
+# Function to take the serving index and its results cache as one snapshot, so a request never mixes generations
+def load_serving():
+    load_index()
+    with collection_lock:
+        return search_index, results_cache
+
+# Rebuilds only re-embed new or changed posts unless a full rebuild is requested
+FULL_REBUILD = os.environ.get('CHROMA_FULL_REBUILD', 'false').lower() == 'true'
+INDEX_PAGE_SIZE = 1000
+REBUILD_PAGE_SIZE = int(os.environ.get('REBUILD_PAGE_SIZE', 500))
+REBUILD_BATCH_SIZE = int(os.environ.get('REBUILD_BATCH_SIZE', 500))
+
+# Posts eligible for recommendation: the tagged, category, popular and latest windows and the author blocklist
+REBUILD_EXCLUDED_AUTHORS = [int(author) for author in os.environ.get(
+    'REBUILD_EXCLUDED_AUTHORS', '6301,5873,5947,6430,6524,6554,5684').split(',') if author.strip()]
+REBUILD_EVERGREEN_TAG = os.environ.get('REBUILD_EVERGREEN_TAG', '_evergreen')
+REBUILD_EVERGREEN_MONTHS = int(os.environ.get('REBUILD_EVERGREEN_MONTHS', 6))
+REBUILD_COMMERCE_CATEGORY = os.environ.get('REBUILD_COMMERCE_CATEGORY', 'commerce')
+REBUILD_COMMERCE_MONTHS = int(os.environ.get('REBUILD_COMMERCE_MONTHS', 1))
+REBUILD_POPULAR_MONTHS = int(os.environ.get('REBUILD_POPULAR_MONTHS', 12))
+REBUILD_LATEST_DAYS = int(os.environ.get('REBUILD_LATEST_DAYS', 7))
+
+TERM_TAXONOMY_QUERY = """
+        SELECT tt.term_taxonomy_id, tt.taxonomy
+        FROM wp_term_taxonomy tt
+        JOIN wp_terms t ON t.term_id = tt.term_id
+        WHERE (t.name = %s AND tt.taxonomy = 'post_tag')
+        OR (t.name = %s AND tt.taxonomy = 'category')
+"""
+
+# Eligibility only reads narrow columns; post_content is fetched afterwards for the posts that changed
+TERM_ELIGIBILITY_QUERY = """
+        SELECT wp.ID, wp.post_date, wp.post_modified
+        FROM wp_posts wp
+        JOIN wp_term_relationships tr ON tr.object_id = wp.ID
+        WHERE tr.term_taxonomy_id IN ({term_ids})
+        AND wp.post_status = 'publish'
+        AND wp.post_type = 'post'
+        AND wp.post_modified > DATE_SUB(NOW(), INTERVAL %s MONTH)
+        {author_filter}
+"""
+
+POPULAR_ELIGIBILITY_QUERY = """
+        SELECT wp.ID, wp.post_date, wp.post_modified
+        FROM wp_posts wp
+        JOIN popular_posts pp ON pp.post_id = wp.ID
+        WHERE wp.post_modified > DATE_SUB(NOW(), INTERVAL %s MONTH)
+        {author_filter}
+"""
+
+LATEST_ELIGIBILITY_QUERY = """
+        SELECT wp.ID, wp.post_date, wp.post_modified
+        FROM wp_posts wp
+        WHERE wp.post_status = 'publish'
+        AND wp.post_type = 'post'
+        AND wp.post_date > DATE_SUB(NOW(), INTERVAL %s DAY)
+        {author_filter}
+"""
+
+# The daily rebuild or sync only runs in processes started with ENABLE_SCHEDULER=true
+ENABLE_SCHEDULER = os.environ.get('ENABLE_SCHEDULER', 'false').lower() == 'true'
+# Only the process holding this lock runs the daily rebuild or sync
+SCHEDULER_LOCK_PATH = os.environ.get('SCHEDULER_LOCK_PATH', '/tmp/retriever-scheduler.lock')
+scheduler_lock_file = None
+
+# Replicas mirror the latest S3 snapshot here and copy it into a new collection generation
+SYNC_STAGING_PATH = os.environ.get('SYNC_STAGING_PATH', '/app/chromadb_sync')
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', 5000))
+synced_snapshot_version = None
+
+# Precomputed recommendations keyed by (post_content_id, nresults), rebuilt whenever the collection changes
+RESULTS_CACHE_SIZE = int(os.environ.get('RESULTS_CACHE_SIZE', 50000))
+RESULTS_CACHE_TTL = int(os.environ.get('RESULTS_CACHE_TTL', 25 * 3600))
+RESULTS_CACHE_WARM_NRESULTS = int(os.environ.get('RESULTS_CACHE_WARM_NRESULTS', 6))
+RESULTS_CACHE_WARM_BATCH = 100
+results_cache = TTLCache(maxsize=RESULTS_CACHE_SIZE, ttl=RESULTS_CACHE_TTL)
+
+# Every chunk of a post is indexed as its own document, linked back to the post by its post_id metadata
+MAX_CHUNKS_PER_POST = int(os.environ.get('MAX_CHUNKS_PER_POST', 8))
+
+# Max post ids accepted by one /api/results/batch request
+MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', 500))
+# Post ids in JSON bodies are integers or strings of ASCII digits
+POST_ID_PATTERN = re.compile(r'[0-9]+')
+
+# Query embeddings for posts outside the collection, keyed by a hash of the embedded text
+EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', 5000))
+EMBEDDING_CACHE_TTL = int(os.environ.get('EMBEDDING_CACHE_TTL', 7 * 24 * 3600))
+# Query-time embedding calls retry once, so request latency stays bounded
+EMBED_REQUEST_RETRIES = 1
+embedding_cache = TTLCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL)
 ROLE = os.environ.get('AWS_ROLE_ARN')
 if ROLE and 'production' in ROLE:
     ENV = 'production'
@@ -43,65 +227,131 @@ elif ROLE and 'staging' in ROLE:
 else:
     ENV = 'dev'
 
-# Preprocess text content
-def preprocess_text(text):
-    # Remove HTML tags
-    soup = BeautifulSoup(text, 'html.parser')
-    text = soup.get_text()
-
-    # Lowercasing
-    text = text.lower()
-
-    # Remove URLs
-    text = re.sub(r'http\S+', '', text)
-
-    # Remove special characters and punctuation
-    text = re.sub(r'[^a-zA-Z0-9\s$]', '', text)
-
-    # Remove extra whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    return text
-
-
-# Function to fetch results from ChromaDB
-def get_results(post_content_id, nresults):
+# Function to split preprocessed text into at most MAX_CHUNKS_PER_POST chunks
+def split_post(preprocessed_content, splitter=None):
+    splitter = splitter or get_text_splitter()
+    # Only the text that can end up in a kept chunk is handed to the splitter
+    limit = CHUNK_SIZE * MAX_CHUNKS_PER_POST
+    chunks = splitter.split_text(preprocessed_content[:limit])
+    return chunks[:MAX_CHUNKS_PER_POST] or [preprocessed_content]
+
+
+# Function to build the id of one chunk of a post
+def chunk_id(post_id, chunk_index):
+    return f"{post_id}-{chunk_index}"
+
+
+# Function to embed texts through the embedding cache, in upstream calls bounded by input count and tokens
+def embed_texts(texts):
+    cache_keys = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+    embeddings = [embedding_cache.get(cache_key) for cache_key in cache_keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    for batch in make_batches(missing, [texts[i] for i in missing]):
+        metrics.increment('api_embedding_calls')
+        batch_embeddings = embed_with_retry(get_embedding_function(), [text for _, text in batch],
+                                            max_retries=EMBED_REQUEST_RETRIES)
+        for (i, _), embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+            embedding_cache.set(cache_keys[i], embedding)
+    return embeddings
+
+
+# Function to fetch, preprocess and embed a post that is not in the collection
+def embed_post(post_content_id):
+    with metrics.timed('get_results_db_fetch'):
+        post_content = db.fetch_post_content(post_content_id)
+    if not post_content:
+        logging.info(f"No post content found for post_content_id: {post_content_id}")
+        return None
+    with metrics.timed('get_results_preprocess'):
+        # Preprocess text content
+        preprocessed_content = preprocess_text(post_content)
+        # Split text into chunks for embedding
+        chunks = split_post(preprocessed_content)
+    with metrics.timed('get_results_embed'):
+        return pool_embeddings(embed_texts(chunks))
+
+
+# Function to embed many posts that are not in the collection with one query and batched embedding calls
+def embed_posts(post_content_ids):
+    post_contents = db.fetch_post_contents(post_content_ids)
+    post_chunks = {post_id: split_post(preprocess_text(post_content))
+                   for post_id, post_content in post_contents.items() if post_content}
+    texts = [chunk for chunks in post_chunks.values() for chunk in chunks]
+    embeddings = iter(embed_texts(texts)) if texts else iter(())
+    return {post_id: pool_embeddings([next(embeddings) for _ in chunks]) for post_id, chunks in post_chunks.items()}
+
+
+# Function to read per-request reranking weights, falling back to the configured defaults
+def get_rerank_weights(values):
+    weights = dict(rerank.DEFAULT_WEIGHTS)
+    for key in weights:
+        if values.get(key) is not None:
+            weights[key] = float(values[key])
+    if not (0 <= weights['recency_weight'] <= 1 and 0 <= weights['diversity'] <= 1
+            and weights['half_life_days'] > 0):
+        raise ValueError("recency_weight and diversity must be between 0 and 1, half_life_days above 0")
+    return weights
+
+
+# Function to rank posts for many queries, reranking over-fetched candidates for recency and diversity
+def recommend(target_index, query_embeddings, exclude_ids, nresults, min_timestamp=None, weights=None):
+    weights = weights or rerank.DEFAULT_WEIGHTS
+    if not rerank.is_enabled(weights):
+        return target_index.rank(query_embeddings, exclude_ids, nresults, min_timestamp)
+    rankings = []
+    for post_ids, similarities, embeddings, timestamps in target_index.candidates(
+            query_embeddings, exclude_ids, max(nresults, rerank.RERANK_CANDIDATES), min_timestamp):
+        with metrics.timed('rerank'):
+            picked = rerank.rerank(similarities, embeddings, timestamps, nresults, **weights)
+        rankings.append([post_ids[i] for i in picked])
+    return rankings
+
+
+# Function to check whether results for these options can be cached
+def is_cacheable(min_timestamp, weights):
+    # Only recommendations with the default options are cached
+    return min_timestamp is None and (weights is None or weights == rerank.DEFAULT_WEIGHTS)
+
+
+# Function to fetch results from the vector index
+def get_results(post_content_id, nresults, min_timestamp=None, weights=None):
+    cache_key = (str(post_content_id), nresults) if is_cacheable(min_timestamp, weights) else None
     try:
+        # Rankings are only ever written to the cache of the generation they were computed from
+        serving_index, serving_cache = load_serving()
+        cached = serving_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            metrics.increment('results_cache_hits')
+            return cached
         logging.info(f"Fetching results for post_content_id: {post_content_id}...")
-        # Query the database using the provided post_content_id
-        # Modify the SQL query based on your table structure
-        sql_query = f"SELECT post_content FROM wp_posts WHERE id = {post_content_id}"
-        one_year_ago = datetime.now() - timedelta(days=365)
-        timestamp_one_year_ago = int(one_year_ago.timestamp())
-        with closing(connect(host=os.environ.get('AUTOBLOG_BLOG_DB'), database='blog', user='wp_rw',
-                             password=os.environ.get('AUTOBLOG_BLOG_RW_PASSWORD'), port='3306')) as connection:
-            with closing(connection.cursor()) as cursor:
-                cursor.execute(sql_query)
-                post_content = (cursor.fetchone()[0])
-                # Preprocess text content
-                preprocessed_content = preprocess_text(post_content)
-                logging.info(f"Count: {collection.count()}")
-                # Split text into chunks for embedding
-                tokenized_post_content_query = text_splitter.create_documents([preprocessed_content])[0].page_content
-
-                result = collection.query(query_texts=tokenized_post_content_query, n_results=nresults,
-                                          include=["documents", 'distances', 'metadatas', ])
-                if result:
-                    logging.info(f"Results fetched successfully: {result['ids']}")
-                    # Filter out post_content_id from the results
-                    filtered_ids = [id for id in result['ids'][0] if id != str(post_content_id)]
-                    if filtered_ids:
-                        return filtered_ids
-                    else:
-                        increment_metric('api_results_empty')
-                        logging.info("No valid results found after filtering out the current post_content_id.")
-                        return None
+        # Indexed posts already have an embedding in the collection; only embed the rest
+        with metrics.timed('get_results_lookup'):
+            query_embedding = serving_index.post_embeddings([post_content_id]).get(str(post_content_id))
+        if query_embedding is None:
+            query_embedding = embed_post(post_content_id)
+            if query_embedding is None:
+                return None
+
+        # Filter out post_content_id from the results
+        with metrics.timed('get_results_query'):
+            filtered_ids = recommend(serving_index, [query_embedding], [post_content_id], nresults, min_timestamp,
+                                     weights)[0]
+        logging.info(f"Results fetched successfully: {filtered_ids}")
+        if filtered_ids:
+            if cache_key:
+                serving_cache.set(cache_key, filtered_ids)
+            return filtered_ids
+        else:
+            metrics.increment('api_results_empty')
+            logging.info("No valid results found after filtering out the current post_content_id.")
+            return None
 
     except Error as e:
-        increment_metric('api_errors')
+        metrics.increment('api_errors')
         logging.error(f"Error in database connection: {e}")
     except Exception as e:
-        increment_metric('api_exception')
+        metrics.increment('api_exception')
         logging.error(f"Exception while processing get_results: {e}")
 
     return None
@@ -113,311 +363,528 @@ def api_results():
     try:
         post_content_id = request.args.get('post_content_id', type=int)
         nresults = request.args.get('nresults', default=6, type=int)
-        result = get_results(post_content_id, nresults)
+        min_timestamp = request.args.get('min_timestamp', type=int)
+        try:
+            weights = get_rerank_weights(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        with metrics.timed('api_results'):
+            result = get_results(post_content_id, nresults, min_timestamp, weights)
 
         # Aggregate metric for API requests
-        increment_metric('api_requests')
+        metrics.increment('api_requests')
 
         # Check if results are not null or empty
         if not result:
-            increment_metric('api_results_empty')
+            metrics.increment('api_results_empty')
 
         return jsonify(result)
     except Error as e:
         logging.error(f"Error in api_results: {e}")
-        increment_metric('api_errors')
+        metrics.increment('api_errors')
     except Exception as e:
         logging.error(f"Exception in api_results: {e}")
-        increment_metric('api_exception')
+        metrics.increment('api_exception')
 
     return jsonify({'error': 'Internal Server Error'}), 500
 
 
-# Function to send aggregated metrics
-def send_aggregated_metrics():
+# Function to fetch results for many posts at once, reporting failures per id
+def get_batch_results(post_content_ids, nresults, min_timestamp=None, weights=None):
+    results, errors = {}, {}
+    pending = []
+    cacheable = is_cacheable(min_timestamp, weights)
+    # Rankings are only ever written to the cache of the generation they were computed from
+    serving_index, serving_cache = load_serving()
+    # Normalized so that '007' matches both the index and the database's '7'
+    for post_id in dict.fromkeys(str(int(id)) for id in post_content_ids):
+        cached = serving_cache.get((post_id, nresults)) if cacheable else None
+        if cached is not None:
+            results[post_id] = cached
+        else:
+            pending.append(post_id)
+    if not pending:
+        return results, errors
+
+    logging.info(f"Fetching batch results for {len(pending)} post_content_ids...")
+    query_embeddings = serving_index.post_embeddings(pending)
+    not_indexed = [post_id for post_id in pending if post_id not in query_embeddings]
+    if not_indexed:
+        try:
+            query_embeddings.update(embed_posts(not_indexed))
+        except Error as e:
+            metrics.increment('api_errors')
+            logging.error(f"Error in database connection: {e}")
+            errors.update({post_id: 'Database error' for post_id in not_indexed})
+        except Exception as e:
+            metrics.increment('api_exception')
+            logging.error(f"Exception while embedding batch posts: {e}")
+            errors.update({post_id: 'Embedding error' for post_id in not_indexed})
+
+    query_ids = [post_id for post_id in pending if post_id in query_embeddings]
+    for post_id in pending:
+        if post_id not in query_embeddings and post_id not in errors:
+            errors[post_id] = 'Post not found'
+    if query_ids:
+        rankings = recommend(serving_index, [query_embeddings[post_id] for post_id in query_ids], query_ids, nresults,
+                             min_timestamp, weights)
+        for post_id, filtered_ids in zip(query_ids, rankings):
+            if filtered_ids:
+                if cacheable:
+                    serving_cache.set((post_id, nresults), filtered_ids)
+                results[post_id] = filtered_ids
+            else:
+                metrics.increment('api_results_empty')
+                results[post_id] = None
+    return results, errors
+
+
+# Function to check that a JSON value is a whole number; bools are ints in Python but not in JSON
+def is_json_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Function to check that a JSON value is a post id that int() accepts, as an integer or a string of ASCII digits
+def is_post_id(value):
+    if isinstance(value, str):
+        return POST_ID_PATTERN.fullmatch(value) is not None
+    return is_json_int(value) and value >= 0
+
+
+# Route to handle batch API requests
+@app.route('/api/results/batch', methods=['POST'])
+def api_results_batch():
     try:
-        if metrics:
-            logging.info("Sending send_aggregated_metrics")
-            # Send aggregated metrics
-            yamas_api = YamasCollectorAPI(
-                namespace=os.environ.get('YAMAS_NAMESPACE'),
-                endpoint=PUBLIC,
-                key_path=os.environ.get('SIA_KEY_PATH'),
-                cert_path=os.environ.get('SIA_CERT_PATH')
-            )
-            message = YamasMessage(application='autoblog', metrics=metrics)
-            yamas_api.send_message(message)
-            logging.info("Aggregated metrics sent successfully")
-            metrics.clear()  # Reset metrics dictionary after sending
-    except YamasError as error:
-        logging.error(f"Error sending aggregated metrics: {error}")
-        timer.cancel()
-
-
-# Start timer to send aggregated metrics every second
-def start_timer():
-    threading.Timer(60.0, start_timer).start()
-    send_aggregated_metrics()
-
-
-# Function to send aggregated metrics once
-def send_aggregated_metrics_once():
-    global timer
-    if timer is None or not timer.is_alive():
-        send_aggregated_metrics()
-        timer = threading.Timer(60.0, start_timer)
-        timer.start()
-
-
-# Function to increment metrics
-def increment_metric(metric_name):
-    if metric_name in metrics:
-        metrics[metric_name] += 1
-    else:
-        metrics[metric_name] = 1
+        payload = request.get_json(silent=True) or {}
+        post_content_ids = payload.get('post_content_ids')
+        nresults = payload.get('nresults', 6)
+        min_timestamp = payload.get('min_timestamp')
+        if (not isinstance(post_content_ids, list) or not post_content_ids
+                or not all(is_post_id(id) for id in post_content_ids) or not is_json_int(nresults)
+                or not (min_timestamp is None or is_json_int(min_timestamp))):
+            return jsonify({'error': 'post_content_ids must be a non-empty list of post ids'}), 400
+        if len(post_content_ids) > MAX_BATCH_IDS:
+            return jsonify({'error': f'At most {MAX_BATCH_IDS} post_content_ids per request'}), 400
+        try:
+            weights = get_rerank_weights(payload)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
 
+        with metrics.timed('api_results_batch'):
+            results, errors = get_batch_results(post_content_ids, nresults, min_timestamp, weights)
 
-# Function to update ChromaDB collection
-def update_chroma_collection():
-    try:
-        logging.info("Updating ChromaDB collection...")
-        global client, collection
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=8000, chunk_overlap=0)
-        # Fetch data from the database
-        documents = []
-        metadatas = []
-        ids = []
-        try:
-            with closing(connect(host=os.environ.get('AUTOBLOG_BLOG_DB'), database='blog', user='wp_rw',
-                                 password=os.environ.get('AUTOBLOG_BLOG_RW_PASSWORD'),
-                                 port='3306')) as connection:
-                with closing(connection.cursor()) as cursor:
-                    delete_s3_folder_contents()
-                    sql_query = """
-                            SELECT DISTINCT combined.ID, combined.post_content, combined.post_date
-                            FROM (
-                                -- Query 1: Get posts with the tag "_evergreen" modified in the last 6 months
-                                SELECT wp1.ID, wp1.post_content, wp1.post_date
-                                FROM wp_posts wp1
-                                WHERE wp1.ID IN (
-                                    SELECT object_id 
-                                    FROM wp_term_relationships 
-                                    WHERE term_taxonomy_id IN (
-                                        SELECT term_taxonomy_id 
-                                        FROM wp_term_taxonomy 
-                                        WHERE term_id IN (
-                                            SELECT term_id 
-                                            FROM wp_terms 
-                                            WHERE name = '_evergreen'
-                                        ) 
-                                        AND taxonomy = 'post_tag'
-                                    )
-                                )
-                                AND wp1.post_status = 'publish'
-                                AND wp1.post_type = 'post'
-                                AND wp1.post_modified > DATE_SUB(NOW(), INTERVAL 6 MONTH)
-                                AND wp1.post_author NOT IN (6301, 5873, 5947, 6430, 6524, 6554, 5684)
-
-                                UNION ALL
-
-                                -- Query 2: Get posts with the category "commerce" modified in the last 1 month
-                                SELECT wp2.ID, wp2.post_content, wp2.post_date
-                                FROM wp_posts wp2
-                                WHERE wp2.ID IN (
-                                    SELECT object_id 
-                                    FROM wp_term_relationships 
-                                    WHERE term_taxonomy_id IN (
-                                        SELECT term_taxonomy_id 
-                                        FROM wp_term_taxonomy 
-                                        WHERE term_id IN (
-                                            SELECT term_id 
-                                            FROM wp_terms 
-                                            WHERE name = 'commerce'
-                                        ) 
-                                        AND taxonomy = 'category'
-                                    )
-                                )
-                                AND wp2.post_status = 'publish'
-                                AND wp2.post_type = 'post'
-                                AND wp2.post_modified > DATE_SUB(NOW(), INTERVAL 1 MONTH)
-                                AND wp2.post_author NOT IN (6301, 5873, 5947, 6430, 6524, 6554, 5684)
-
-                                UNION ALL
-
-                                -- Query 3: Get distinct popular posts excluding specific authors
-                                SELECT wpp.ID, wpp.post_content, wpp.post_date
-                                FROM wp_posts wpp
-                                JOIN popular_posts wppp ON wpp.ID = wppp.post_id
-                                WHERE wpp.post_author NOT IN (6301, 5873, 5947, 6430, 6524, 6554, 5684) 
-                                AND wpp.post_modified > DATE_SUB(NOW(), INTERVAL 1 YEAR)
-                                
-                                UNION ALL
-
-                                -- Query 4: Get latest published articles from wp_posts within one week from the current date
-                                SELECT wp3.ID, wp3.post_content, wp3.post_date
-                                FROM wp_posts wp3
-                                WHERE wp3.post_status = 'publish'
-                                AND wp3.post_type = 'post'
-                                AND wp3.post_date > DATE_SUB(NOW(), INTERVAL 1 WEEK)
-                                AND wp3.post_author NOT IN (6301, 5873, 5947, 6430, 6524, 6554, 5684)
-                            ) AS combined
-                            ORDER BY combined.post_date;
-                        """
-                    cursor.execute(sql_query)
-                    results = cursor.fetchall()
-                    for r in results:
-                        post_id, post_content, post_date = r
-                        if post_content:
-                            preprocessed_content = preprocess_text(post_content)
-                            tokenized_post_content = text_splitter.create_documents([preprocessed_content])[
-                                0].page_content
-                            post_timestamp = int(post_date.timestamp())
-                            documents.append(tokenized_post_content)
-                            metadatas.append({
-                                "formatted_date": post_date.strftime("%Y-%m-%d %H:%M:%S"),
-                                "timestamp": post_timestamp
-                            })
-                            ids.append(str(post_id))
+        # Aggregate metric for API requests
+        metrics.increment('api_batch_requests')
+        return jsonify({'results': results, 'errors': errors})
+    except Error as e:
+        logging.error(f"Error in api_results_batch: {e}")
+        metrics.increment('api_errors')
+    except Exception as e:
+        logging.error(f"Exception in api_results_batch: {e}")
+        metrics.increment('api_exception')
 
-        except Error as e:
-            logging.error(f"Error in database connection: {e}")
+    return jsonify({'error': 'Internal Server Error'}), 500
+
+
+# Readiness probe: 200 once the serving index is loaded, 503 until then
+@app.route('/ready', methods=['GET'])
+def api_ready():
+    if search_index is None:
+        return jsonify({'ready': False}), 503
+    return jsonify({'ready': True, 'collection': search_index.name, 'backend': VECTOR_BACKEND,
+                    'ready_seconds': round(ready_seconds, 3)})
+
+
+# Route to expose MySQL connection pool usage
+@app.route('/api/db-stats', methods=['GET'])
+def api_db_stats():
+    return jsonify(db.get_pool_stats())
+
+
+# Function to read the metadata and chunk ids stored for every indexed post
+def get_indexed_posts(target_collection):
+    indexed_posts = {}
+    total = target_collection.count()
+    for offset in range(0, total, INDEX_PAGE_SIZE):
+        batch = target_collection.get(include=["metadatas"], limit=INDEX_PAGE_SIZE, offset=offset)
+        for id, metadata in zip(batch["ids"], batch["metadatas"]):
+            metadata = metadata or {}
+            # Documents indexed before chunking have no post_id and use the post id as document id
+            post = indexed_posts.setdefault(str(metadata.get("post_id", id)), {"metadata": metadata, "chunk_ids": []})
+            post["chunk_ids"].append(id)
+    return indexed_posts
+
+
+# Function to resolve the evergreen tag and commerce category to their term_taxonomy ids, once per rebuild
+def get_eligible_term_ids():
+    term_ids = {'post_tag': [], 'category': []}
+    rows = db.fetch_all(TERM_TAXONOMY_QUERY, (REBUILD_EVERGREEN_TAG, REBUILD_COMMERCE_CATEGORY))
+    for term_taxonomy_id, taxonomy in rows:
+        term_ids[taxonomy].append(int(term_taxonomy_id))
+    return term_ids
+
+
+# Function to select the (post_id, post_date, post_modified) rows of every post eligible for recommendation
+def fetch_eligible_posts():
+    authors = list(REBUILD_EXCLUDED_AUTHORS)
+    author_filter = f"AND wp.post_author NOT IN ({', '.join(['%s'] * len(authors))})" if authors else ""
+    term_ids = get_eligible_term_ids()
+    queries, params = [], []
+    for taxonomy, months in (('post_tag', REBUILD_EVERGREEN_MONTHS), ('category', REBUILD_COMMERCE_MONTHS)):
+        if not term_ids[taxonomy]:
+            logging.info(f"No {taxonomy} term found for the rebuild eligibility query, skipping it")
+            continue
+        placeholders = ', '.join(['%s'] * len(term_ids[taxonomy]))
+        queries.append(TERM_ELIGIBILITY_QUERY.format(term_ids=placeholders, author_filter=author_filter))
+        params.extend(term_ids[taxonomy] + [months] + authors)
+    queries.append(POPULAR_ELIGIBILITY_QUERY.format(author_filter=author_filter))
+    params.extend([REBUILD_POPULAR_MONTHS] + authors)
+    queries.append(LATEST_ELIGIBILITY_QUERY.format(author_filter=author_filter))
+    params.extend([REBUILD_LATEST_DAYS] + authors)
+    # UNION drops posts matched by several windows, which is cheap now that rows carry no content
+    rows = db.fetch_all("\n        UNION\n".join(queries), tuple(params))
+    return sorted(rows, key=lambda row: int(row[0]))
+
+
+# Function to check whether an indexed post was last embedded from the same revision
+def is_unmodified(indexed, post_modified):
+    return (indexed is not None and "content_hash" in indexed["metadata"]
+            and indexed["metadata"].get("post_modified") == int(post_modified.timestamp()))
+
+
+# Function to attach post_content to eligible rows, fetched in keyed batches only for modified posts
+def fetch_modified_contents(candidates, indexed_posts, page_size=REBUILD_PAGE_SIZE):
+    modified_ids = [str(post_id) for post_id, _, post_modified in candidates
+                    if not is_unmodified(indexed_posts.get(str(post_id)), post_modified)]
+    contents = {}
+    for id_batch in batched(modified_ids, page_size):
+        contents.update(db.fetch_post_contents(id_batch))
+    modified_ids = set(modified_ids)
+    # Unmodified posts get None content; a post deleted since eligibility was read gets '' and is dropped
+    return [(post_id, contents.get(str(post_id), '') if str(post_id) in modified_ids else None,
+             post_date, post_modified) for post_id, post_date, post_modified in candidates], len(modified_ids)
+
+
+# Function to turn a batch of rows into (post_id, chunks, metadata) records, skipping unchanged posts
+def prepare_posts(rows, indexed_posts, chunk_counts, text_splitter, executor=None):
+    records, changed = [], []
+    for post_id, post_content, post_date, post_modified in rows:
+        if post_content is None:
+            # Not fetched because post_modified is unchanged, so the stored hash still describes the text
+            content_hash = indexed_posts[str(post_id)]["metadata"]["content_hash"]
+        elif not post_content:
+            continue
+        else:
+            content_hash = hashlib.sha256(post_content.encode('utf-8')).hexdigest()
+        metadata = {
+            "post_id": str(post_id),
+            "formatted_date": post_date.strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp": int(post_date.timestamp()),
+            "post_modified": int(post_modified.timestamp()),
+            "content_hash": content_hash
+        }
+        indexed = indexed_posts.get(str(post_id))
+        if indexed and indexed["metadata"].get("content_hash") == content_hash:
+            # Same text, so the stored embeddings are still valid; refresh metadata only
+            chunk_counts[str(post_id)] = len(indexed["chunk_ids"])
+            if any(indexed["metadata"].get(key) != value for key, value in metadata.items()):
+                records.append((str(post_id), None, metadata))
+            continue
+        changed.append((str(post_id), post_content, metadata))
+
+    preprocessed_contents = preprocess_texts([post_content for _, post_content, _ in changed], executor)
+    for (post_id, _, metadata), preprocessed_content in zip(changed, preprocessed_contents):
+        chunks = split_post(preprocessed_content, text_splitter)
+        chunk_counts[post_id] = len(chunks)
+        records.append((post_id, chunks, metadata))
+    return records
+
+
+# Function to group a stream into lists of at most batch_size items
+def batched(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        finally:
-            if connection:
-                connection.close()
 
-        if documents:
-            client.delete_collection(name="embedded_posts")
-            collection = client.get_or_create_collection(name="embedded_posts", embedding_function=openai_ef)
-            collection.add(documents=documents, metadatas=metadatas, ids=ids)
-            if collection.count():
-                logging.info(f"Updated collection count: {collection.count()}")
-                s3_upload()
-            logging.info(f"ChromaDB collection updated successfully. Total records: {collection.count()}")
+# Function to update ChromaDB collection
+def update_chroma_collection(full_rebuild=FULL_REBUILD):
+    new_collection = None
+    preprocess_executor = None
+    try:
+        logging.info(f"Updating ChromaDB collection ({'full rebuild' if full_rebuild else 'incremental'})...")
+        load_index()
+        text_splitter = create_text_splitter()
+
+        # Compare against what is already indexed so only new or edited posts are embedded again
+        indexed_posts = {} if full_rebuild else get_indexed_posts(collection)
+        chunk_counts = {}
+        embedded_count = touched_count = 0
+        embedding_checkpoint = EmbeddingCheckpoint()
+        preprocess_executor = create_preprocess_executor()
+
+        # Eligibility is read once; content is then fetched by id and written to Chroma in fixed-size batches
+        started = time.perf_counter()
+        candidates = fetch_eligible_posts()
+        eligibility_seconds = time.perf_counter() - started
+        metrics.observe('rebuild_db_eligibility', eligibility_seconds)
+        content_seconds, fetched_count = 0.0, 0
+        for candidate_batch in batched(candidates, REBUILD_BATCH_SIZE):
+            started = time.perf_counter()
+            row_batch, modified_count = fetch_modified_contents(candidate_batch, indexed_posts)
+            batch_seconds = time.perf_counter() - started
+            metrics.observe('rebuild_db_content', batch_seconds)
+            content_seconds += batch_seconds
+            fetched_count += modified_count
+            batch = prepare_posts(row_batch, indexed_posts, chunk_counts, text_splitter, preprocess_executor)
+            if not batch:
+                continue
+            if new_collection is None:
+                new_collection = start_collection_generation(copy_serving=not full_rebuild)
+            ids, documents, metadatas, replaced_ids = [], [], [], []
+            for post_id, chunks, metadata in batch:
+                if chunks is None:
+                    chunk_ids = indexed_posts[post_id]["chunk_ids"]
+                    new_collection.update(ids=chunk_ids,
+                                          metadatas=[dict(metadata, chunk=i) for i in range(len(chunk_ids))])
+                    touched_count += 1
+                    continue
+                if post_id in indexed_posts:
+                    # The chunk count may have changed, so drop every old chunk of an edited post
+                    replaced_ids.extend(indexed_posts[post_id]["chunk_ids"])
+                for i, chunk in enumerate(chunks):
+                    ids.append(chunk_id(post_id, i))
+                    documents.append(chunk)
+                    metadatas.append(dict(metadata, chunk=i))
+                embedded_count += 1
+            if replaced_ids:
+                new_collection.delete(ids=replaced_ids)
+            if documents:
+                embeddings = embed_documents(ids, documents, get_embedding_function(),
+                                             checkpoint=embedding_checkpoint)
+                new_collection.upsert(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+        metrics.observe('rebuild_db', eligibility_seconds + content_seconds)
+        logging.info(f"Rebuild DB time: {eligibility_seconds + content_seconds:.2f}s "
+                     f"(eligibility {eligibility_seconds:.2f}s for {len(candidates)} posts, "
+                     f"content {content_seconds:.2f}s for {fetched_count} posts)")
+        logging.info(f"MySQL pool stats: {db.get_pool_stats()}")
+
+        stale_ids = [id for post_id, post in indexed_posts.items() if post_id not in chunk_counts
+                     for id in post["chunk_ids"]]
+        logging.info(f"Rebuild delta: {embedded_count} posts new or changed, {len(stale_ids)} chunks removed, "
+                     f"{touched_count} metadata-only, {len(chunk_counts) - embedded_count} unchanged posts")
+        if stale_ids:
+            if new_collection is None:
+                new_collection = start_collection_generation(copy_serving=not full_rebuild)
+            new_collection.delete(ids=stale_ids)
+
+        if new_collection is not None:
+            swap_collection(new_collection, expected_count=sum(chunk_counts.values()))
+            # The new generation is serving now, so no error path below may delete it
+            new_collection = None
+            embedding_checkpoint.clear()
+            delete_unserved_generations()
+
+        if collection.count():
+            logging.info(f"Updated collection count: {collection.count()}")
+            s3_upload()
+        logging.info(f"ChromaDB collection updated successfully. Total records: {collection.count()}")
 
         logging.info("ChromaDB collection update completed.")
+    except Error as e:
+        logging.error(f"Error in database connection: {e}")
     except Exception as e:
         logging.error(f"Error in update_chroma_collection: {e}")
+    finally:
+        if preprocess_executor is not None:
+            preprocess_executor.shutdown()
+        if new_collection is not None:
+            get_client().delete_collection(name=new_collection.name)
+
+
+# Function to precompute recommendations for every indexed post
+def warm_results_cache(target_index, nresults=RESULTS_CACHE_WARM_NRESULTS):
+    warmed = TTLCache(maxsize=RESULTS_CACHE_SIZE, ttl=RESULTS_CACHE_TTL)
+    warm_index, scratch_path = target_index, None
+    if not isinstance(target_index, vector_index.NumpyIndex):
+        # One Chroma query per post is far too slow, so every post is ranked in bulk on a scratch NumPy index
+        scratch_path = os.path.join(VECTOR_INDEX_PATH, f"{target_index.name}.warm")
+        vector_index.build_numpy_index(target_index.collection, scratch_path)
+        warm_index = vector_index.NumpyIndex(scratch_path)
+    try:
+        for batch in batched(warm_index.iter_post_embeddings(), RESULTS_CACHE_WARM_BATCH):
+            post_ids = [post_id for post_id, _ in batch]
+            rankings = recommend(warm_index, [embedding for _, embedding in batch], post_ids, nresults)
+            for post_id, filtered_ids in zip(post_ids, rankings):
+                if filtered_ids:
+                    warmed.set((post_id, nresults), filtered_ids)
+    finally:
+        if scratch_path:
+            shutil.rmtree(scratch_path, ignore_errors=True)
+    return warmed
+
+
+# Function to create the next collection generation, seeded from the serving one for incremental updates
+def start_collection_generation(copy_serving):
+    new_collection = get_client().create_collection(name=new_collection_name(),
+                                                    embedding_function=get_embedding_function())
+    if copy_serving:
+        # Start from the serving generation so unchanged posts keep their embeddings
+        copy_collection(collection, new_collection)
+    return new_collection
+
+
+# Function to name the next collection generation
+def new_collection_name():
+    return f"{COLLECTION_NAME}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+
+# Function to copy every record, embeddings included, between collections
+def copy_collection(source_collection, target_collection, page_size=INDEX_PAGE_SIZE):
+    for offset in range(0, source_collection.count(), page_size):
+        batch = source_collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size,
+                                      offset=offset)
+        if batch["ids"]:
+            target_collection.add(ids=batch["ids"], documents=batch["documents"], metadatas=batch["metadatas"],
+                                  embeddings=batch["embeddings"])
+
+
+# Function to verify a freshly built generation and make it the serving collection
+def swap_collection(new_collection, expected_count=None):
+    global collection, search_index, results_cache
+    count = new_collection.count()
+    if not count or (expected_count is not None and count != expected_count):
+        raise ValueError(f"Refusing to swap to {new_collection.name}: {count} records, expected {expected_count}")
+    new_index = open_vector_index(new_collection)
 
-
-def delete_s3_folder_contents():
-    logging.info("Running delete s3 contents...")
-    s3 = boto3.client('s3')
-    aws_region = os.getenv('AWS_REGION', 'us-east-1')  # Default to 'us-east-1' if not set
-    bucket_name = f'autoblog-ai-{ENV}-{aws_region}'
-    s3_path = 'chromadb/'  # Updated S3 path to 'chromadb/'
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=s3_path)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                s3.delete_object(Bucket=bucket_name, Key=obj['Key'])
+        logging.info("Warming results cache...")
+        warmed = warm_results_cache(new_index)
+        logging.info(f"Results cache warmed with {len(warmed)} entries")
+    except Exception as e:
+        warmed = TTLCache(maxsize=RESULTS_CACHE_SIZE, ttl=RESULTS_CACHE_TTL)
+        logging.error(f"Error warming results cache: {e}")
 
-        time.sleep(300)
-        logging.info(f"All objects in {s3_path} deleted successfully")
+    # Swapping the references together invalidates every stale recommendation at once
+    with collection_lock:
+        collection = new_collection
+        search_index = new_index
+        results_cache = warmed
+    logging.info(f"Serving collection switched to {new_collection.name} with {count} records")
 
-    except NoCredentialsError:
-        logging.error("Credentials not available")
-    except Exception as e:
-        logging.error(f"Failed to delete objects in {s3_path}: {e}")
 
-# Function to upload ChromaDB to S3
-def upload_to_s3(local_path, bucket_name, s3_path):
-    # Create an S3 client
-    s3 = boto3.client('s3')
+# Function to garbage-collect after a swap; a failure here is logged and never reaches the swap's error handling
+def delete_unserved_generations():
     try:
-        # Upload the entire directory to S3
-        for root, dirs, files in os.walk(local_path):
-            for file in files:
-                local_file_path = os.path.join(root, file)
-                s3_key = os.path.relpath(local_file_path, local_path)
-                s3_object_key = os.path.join(s3_path, s3_key)
-                s3.upload_file(local_file_path, bucket_name, s3_object_key,
-                               ExtraArgs={'ServerSideEncryption': 'AES256'})
-
-        logging.info("Upload successful")
+        delete_old_generations(get_client())
+    except Exception as e:
+        logging.error(f"Error deleting old collection generations: {e}")
 
-    except NoCredentialsError:
-        logging.error("Credentials not available")
 
-    except Exception as e:
-        logging.error(f"Upload failed: {e}")
+# Function to garbage-collect collection generations that are no longer served
+def delete_old_generations(target_client, keep=COLLECTION_GENERATIONS_KEPT):
+    generations = list_collection_generations(target_client)
+    for name in generations[:-keep] if keep > 0 else generations:
+        if name != collection.name:
+            target_client.delete_collection(name=name)
+            logging.info(f"Deleted old collection generation {name}")
+    vector_index.delete_numpy_indexes(VECTOR_INDEX_PATH, set(list_collection_generations(target_client)))
 
 
-# Function to upload ChromaDB to S3
+# Function to upload ChromaDB to S3 as a new snapshot version
 def s3_upload():
+    import snapshot
+    from botocore.exceptions import NoCredentialsError
     logging.info("Running upload_to_s3...")
     aws_region = os.getenv('AWS_REGION', 'us-east-1')  # Default to 'us-east-1' if not set
     s3_bucket_name = f'autoblog-ai-{ENV}-{aws_region}'
-    local_chromadb_path = '/app/chromadb/'
-    s3_chromadb_path = 'chromadb/'  # Updated S3 path to 'chromadb/'
-
-    upload_to_s3(local_chromadb_path, s3_bucket_name, s3_chromadb_path)
-
-
-def download_from_s3(bucket_name, s3_path, local_path):
-    # Create an S3 client
-    s3 = boto3.client('s3')
+    local_chromadb_path = CHROMA_PATH
+    s3_chromadb_path = 'chromadb/'
     try:
-        # List objects in the specified S3 path
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=s3_path)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                s3_key = obj['Key']
-                if s3_key.endswith('/'):
-                    continue  # Skip directories
-                local_file_path = os.path.join(local_path, os.path.relpath(s3_key, s3_path))
-                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-                s3.download_file(bucket_name, s3_key, local_file_path)
-
-        logging.info("Download successful")
-
+        snapshot.upload_snapshot(local_chromadb_path, s3_bucket_name, s3_chromadb_path)
+        logging.info("Upload successful")
     except NoCredentialsError:
         logging.error("Credentials not available")
-
     except Exception as e:
-        logging.error(f"Download failed: {e}")
+        logging.error(f"Upload failed: {e}")
 
 
+# Function to download the latest ChromaDB snapshot from S3
 def s3_download(local_path):
-    print("Running s3_download...")
+    import snapshot
+    from botocore.exceptions import NoCredentialsError
+    logging.info("Running s3_download...")
     aws_region = os.getenv('AWS_REGION', 'us-east-1')  # Default to 'us-east-1' if not set
     s3_bucket_name = f'autoblog-ai-{ENV}-{aws_region}'
-    local_chromadb_path = local_path
     s3_chromadb_path = 'chromadb/'
-
-    download_from_s3(s3_bucket_name, s3_chromadb_path, local_chromadb_path)
+    try:
+        manifest = snapshot.download_snapshot(s3_bucket_name, s3_chromadb_path, local_path)
+        logging.info("Download successful")
+        # Snapshots written before versioning have no manifest
+        return manifest['version'] if manifest else ''
+    except NoCredentialsError:
+        logging.error("Credentials not available")
+    except Exception as e:
+        logging.error(f"Download failed: {e}")
+    return None
 
 
 def sync_chromadb():
+    import chromadb
     logging.info("Syncing ChromaDB collection...")
-    global client
-    global collection
+    global synced_snapshot_version
+    load_index()
+    # The staging directory persists between syncs, so only files that changed are downloaded
+    version = s3_download(SYNC_STAGING_PATH)
+    if version is None:
+        logging.error("Skipping ChromaDB sync because the snapshot download failed")
+        return
+    if version and version == synced_snapshot_version:
+        logging.info(f"ChromaDB collection already at snapshot {version}")
+        return
+
+    # Open a private copy: Chroma caches one client per path, so the staging directory must not be opened directly
     now = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     tmp_dir = f"/tmp/chromadb_{now}"
-    s3_download(tmp_dir)
+    shutil.copytree(SYNC_STAGING_PATH, tmp_dir)
     client_tmp = chromadb.PersistentClient(path=tmp_dir)
-    collection_tmp = client_tmp.get_or_create_collection(name="embedded_posts", embedding_function=openai_ef)
-    count = collection_tmp.count()
-
-    documents, metadatas, ids, embeddings = [], [], [], []
-    for i in range(0, collection_tmp.count(), 10):
-        batch = collection_tmp.get(
-            include=["metadatas", "documents", "embeddings"],
-            limit=10,
-            offset=i)
-        ids.extend(batch["ids"])
-        metadatas.extend(batch["metadatas"])
-        documents.extend(batch["documents"])
-        embeddings.extend(batch["embeddings"])
-
-    # Add documents to the target collection
-    if documents:
-        client.delete_collection(name="embedded_posts")
-        collection = client.get_or_create_collection(name="embedded_posts", embedding_function=openai_ef)
-        collection.add(documents=documents, metadatas=metadatas, ids=ids)
+    try:
+        collection_tmp = get_serving_collection(client_tmp)
+        count = collection_tmp.count()
+        if count:
+            # Records are copied page by page with their stored embeddings, so nothing is re-embedded
+            new_collection = get_client().create_collection(name=new_collection_name(),
+                                                            embedding_function=get_embedding_function())
+            try:
+                copy_collection(collection_tmp, new_collection, page_size=SYNC_PAGE_SIZE)
+                swap_collection(new_collection, expected_count=count)
+            except Exception as e:
+                # swap_collection only raises before the swap, so the new generation is not serving yet
+                get_client().delete_collection(name=new_collection.name)
+                logging.error(f"Error swapping synced collection: {e}")
+            else:
+                synced_snapshot_version = version
+                delete_unserved_generations()
+            logging.info(f"Updated collection count: {collection.count()}")
+        logging.info(f"ChromaDB collection synced successfully. Total records: {count}")
+    finally:
+        release_client(client_tmp)
         clear_directory(tmp_dir)
-        logging.info(f"Updated collection count: {collection.count()}")
-    logging.info(f"ChromaDB collection synced successfully. Total records: {count}")
+
+
+# Function to stop a PersistentClient and drop it from Chroma's per-path client cache
+def release_client(target_client):
+    from chromadb.api.client import SharedSystemClient
+    try:
+        target_client._system.stop()
+        SharedSystemClient._identifier_to_system.pop(target_client._identifier, None)
+    except Exception as e:
+        logging.warning(f"Error releasing ChromaDB client: {e}")
 
 
 def clear_directory(dir):
@@ -430,6 +897,7 @@ def clear_directory(dir):
 
 
 def call_scheduler(hour, minute, function):
+    from apscheduler.schedulers.background import BackgroundScheduler
     scheduler = BackgroundScheduler()
     scheduler.start()
     now = datetime.now()
@@ -438,22 +906,67 @@ def call_scheduler(hour, minute, function):
         next_run_time += timedelta(days=1)
     # Schedule the update_chroma_collection function to run daily at 9:00 AM UTC
     scheduler.add_job(function, 'interval', hours=24, start_date=next_run_time)
+    return scheduler
 
 
-if ROLE and 'production' in ROLE and 'east' in ROLE:
-    call_scheduler(hour=9, minute=00, function=update_chroma_collection)
-else:
-    call_scheduler(hour=9, minute=30, function=sync_chromadb)
+# Function to start the daily rebuild or sync job in at most one process per host
+def start_scheduler():
+    global scheduler_lock_file
+    if scheduler_lock_file is not None:
+        return None
+    lock_file = open(SCHEDULER_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        logging.info(f"Scheduler already running in another process (pid {os.getpid()} skipped)")
+        return None
+    # The lock is held for the life of the process and released by the OS when it exits
+    scheduler_lock_file = lock_file
+    if ROLE and 'production' in ROLE and 'east' in ROLE:
+        scheduler = call_scheduler(hour=9, minute=00, function=update_chroma_collection)
+    else:
+        scheduler = call_scheduler(hour=9, minute=30, function=sync_chromadb)
+    atexit.register(scheduler.shutdown, wait=False)
+    logging.info(f"Scheduler started in pid {os.getpid()}")
+    return scheduler
+
+
+# Function to load the serving index in the background so the server accepts connections immediately
+def preload_index():
+    def load():
+        try:
+            load_index()
+        except Exception as e:
+            logging.error(f"Error loading serving index: {e}")
+
+    threading.Thread(target=load, name='index-preload', daemon=True).start()
+
+
+# Function to start the metrics flusher, index preload and, when enabled, the scheduler for a serving process
+def start_background_jobs():
+    metrics.start_flusher(metrics.YamasSink())
+    atexit.register(metrics.stop_flusher)
+    preload_index()
+    if ENABLE_SCHEDULER:
+        start_scheduler()
+
+
+# App factory for WSGI servers, e.g. gunicorn 'retriever:create_app()'
+def create_app():
+    start_background_jobs()
+    return app
+
 
 if __name__ == '__main__':
     try:
         logging.info("API Results service started.")
 
-        # Start the timer for metric aggregation
-        send_aggregated_metrics_once()
+        # Start the metrics flusher, index preload and the daily collection job if enabled
+        start_background_jobs()
 
         # Run the Flask app
-        app.run(host='0.0.0.0', port=8080)
+        app.run(host='0.0.0.0', port=8080, threaded=True)
 
 
     except KeyboardInterrupt:
@@ -0,0 +1,24 @@
+# Status codes worth retrying: request timeout, conflict, rate limit, and every server error
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+# Errors without a status code are only retried when the request timed out or never reached the server
+TRANSIENT_ERROR_NAMES = ('APIConnectionError', 'TransportError', 'ConnectionError', 'Timeout')
+
+
+def is_retryable(error):
+    """Return True for errors that may succeed on a later attempt; other 4xx errors fail the same way every time."""
+    status_code = getattr(error, 'status_code', None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+def retry_after(error):
+    """Return the server's Retry-After hint in seconds when the client exposes the response, else None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
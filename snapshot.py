@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+# Snapshot layout under the S3 prefix:
+#   blobs/<sha256>                  file contents, addressed by checksum so unchanged files are never re-sent
+#   snapshots/<version>/manifest.json  relative path -> checksum for one complete snapshot
+#   LATEST                          version of the newest complete snapshot, written last
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+SNAPSHOT_WORKERS = int(os.environ.get('SNAPSHOT_WORKERS', 16))
+SNAPSHOTS_KEPT = int(os.environ.get('SNAPSHOTS_KEPT', 3))
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+DELETE_BATCH_SIZE = 1000
+SSE_ARGS = {'ServerSideEncryption': 'AES256'}
+
+transfer_config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_THRESHOLD,
+                                 max_concurrency=4)
+
+
+def create_s3_client():
+    # S3_ENDPOINT_URL points the client at a local S3 stand-in such as moto or MinIO
+    return boto3.client('s3', endpoint_url=S3_ENDPOINT_URL)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def list_keys(s3, bucket_name, prefix):
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+def delete_keys(s3, bucket_name, keys):
+    keys = list(keys)
+    for i in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[i:i + DELETE_BATCH_SIZE]
+        s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+    return len(keys)
+
+
+def _join(prefix, *parts):
+    return '/'.join([prefix.rstrip('/')] + list(parts))
+
+
+def read_json(s3, bucket_name, key):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=key)['Body'].read())
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def write_json(s3, bucket_name, key, data):
+    s3.put_object(Bucket=bucket_name, Key=key, Body=json.dumps(data).encode('utf-8'),
+                  ContentType='application/json', **SSE_ARGS)
+
+
+def build_manifest(local_path, executor):
+    paths = []
+    for root, dirs, files in os.walk(local_path):
+        for file in files:
+            paths.append(os.path.join(root, file))
+    checksums = executor.map(file_sha256, paths)
+    return {os.path.relpath(path, local_path).replace(os.sep, '/'): {'sha256': checksum, 'size': os.path.getsize(path)}
+            for path, checksum in zip(paths, checksums)}
+
+
+def upload_snapshot(local_path, bucket_name, prefix, s3=None, version=None):
+    """Upload local_path as a new snapshot version, sending only files whose checksum is not already stored."""
+    s3 = s3 or create_s3_client()
+    version = version or datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as executor:
+        files = build_manifest(local_path, executor)
+        stored = {key.rsplit('/', 1)[-1] for key in list_keys(s3, bucket_name, _join(prefix, 'blobs/'))}
+        missing = {}
+        for relative_path, entry in files.items():
+            if entry['sha256'] not in stored:
+                missing.setdefault(entry['sha256'], os.path.join(local_path, relative_path))
+
+        def upload(item):
+            checksum, path = item
+            s3.upload_file(path, bucket_name, _join(prefix, 'blobs', checksum), ExtraArgs=SSE_ARGS,
+                           Config=transfer_config)
+
+        list(executor.map(upload, missing.items()))
+
+    manifest = {'version': version, 'created': datetime.utcnow().isoformat(), 'files': files}
+    write_json(s3, bucket_name, _join(prefix, 'snapshots', version, 'manifest.json'), manifest)
+    # Readers only follow LATEST, so the snapshot becomes visible once every blob and the manifest exist
+    write_json(s3, bucket_name, _join(prefix, 'LATEST'), {'version': version})
+    logging.info(f"Snapshot {version} uploaded: {len(files)} files, {len(missing)} new blobs")
+    delete_old_snapshots(s3, bucket_name, prefix)
+    return manifest
+
+
+def delete_old_snapshots(s3, bucket_name, prefix, keep=SNAPSHOTS_KEPT):
+    manifest_keys = sorted(key for key in list_keys(s3, bucket_name, _join(prefix, 'snapshots/'))
+                           if key.endswith('/manifest.json'))
+    expired, kept = manifest_keys[:-keep], manifest_keys[-keep:]
+    if not expired:
+        return
+    referenced = set()
+    for key in kept:
+        manifest = read_json(s3, bucket_name, key) or {}
+        referenced.update(entry['sha256'] for entry in manifest.get('files', {}).values())
+    unreferenced = [key for key in list_keys(s3, bucket_name, _join(prefix, 'blobs/'))
+                    if key.rsplit('/', 1)[-1] not in referenced]
+    deleted = delete_keys(s3, bucket_name, expired + unreferenced)
+    logging.info(f"Deleted {len(expired)} old snapshots and {deleted - len(expired)} unreferenced blobs")
+
+
+def download_snapshot(bucket_name, prefix, local_path, s3=None):
+    """Make local_path match the latest complete snapshot, skipping files whose checksum already matches."""
+    s3 = s3 or create_s3_client()
+    latest = read_json(s3, bucket_name, _join(prefix, 'LATEST'))
+    if not latest:
+        logging.info("No snapshot manifest found, falling back to a plain prefix download")
+        download_prefix(bucket_name, prefix, local_path, s3)
+        return None
+    manifest = read_json(s3, bucket_name, _join(prefix, 'snapshots', latest['version'], 'manifest.json'))
+    files = manifest['files']
+
+    def download(item):
+        relative_path, entry = item
+        local_file_path = os.path.join(local_path, *relative_path.split('/'))
+        if os.path.exists(local_file_path) and file_sha256(local_file_path) == entry['sha256']:
+            return False
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+        tmp_file_path = f"{local_file_path}.part"
+        s3.download_file(bucket_name, _join(prefix, 'blobs', entry['sha256']), tmp_file_path,
+                         Config=transfer_config)
+        if file_sha256(tmp_file_path) != entry['sha256']:
+            os.remove(tmp_file_path)
+            raise ValueError(f"Checksum mismatch for {relative_path} in snapshot {manifest['version']}")
+        os.replace(tmp_file_path, local_file_path)
+        return True
+
+    os.makedirs(local_path, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as executor:
+        downloaded = sum(executor.map(download, files.items()))
+
+    # Remove files that are not part of the snapshot so the directory mirrors it exactly
+    for root, dirs, local_files in os.walk(local_path):
+        for file in local_files:
+            relative_path = os.path.relpath(os.path.join(root, file), local_path).replace(os.sep, '/')
+            if relative_path not in files:
+                os.remove(os.path.join(root, file))
+    logging.info(f"Snapshot {manifest['version']} downloaded: {downloaded} of {len(files)} files transferred")
+    return manifest
+
+
+def download_prefix(bucket_name, prefix, local_path, s3=None):
+    # Objects written before snapshots existed sit directly under the prefix
+    s3 = s3 or create_s3_client()
+    snapshot_prefixes = (_join(prefix, 'blobs/'), _join(prefix, 'snapshots/'))
+    keys = [key for key in list_keys(s3, bucket_name, prefix)
+            if not key.endswith('/') and not key.startswith(snapshot_prefixes)]
+
+    def download(s3_key):
+        local_file_path = os.path.join(local_path, os.path.relpath(s3_key, prefix))
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+        s3.download_file(bucket_name, s3_key, local_file_path, Config=transfer_config)
+
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as executor:
+        list(executor.map(download, keys))
+
+
+if __name__ == '__main__':
+    # Usage: python snapshot.py download|upload <bucket> <prefix> <local_path>
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    command, bucket, s3_prefix, path = sys.argv[1:5]
+    if command == 'download':
+        download_snapshot(bucket, s3_prefix, path)
+    elif command == 'upload':
+        upload_snapshot(path, bucket, s3_prefix)
+    else:
+        sys.exit(f"Unknown command: {command}")
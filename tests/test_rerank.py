@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import rerank
+from benchmark import fixture_corpus, selection_stats
+
+NOW = 1.7e9
+SEEDS = range(1, 9)
+NRESULTS = 6
+
+
+def pick(seed, **weights):
+    # Rerank the nearest candidates for a query that sits between two topics of the fixture corpus
+    embeddings, timestamps, topic_ids = fixture_corpus(seed=seed, now=NOW)
+    query = embeddings[0] + embeddings[25]
+    query /= np.linalg.norm(query)
+    similarities = embeddings @ query
+    candidates = np.argsort(-similarities)[1:rerank.RERANK_CANDIDATES + 1]
+    picked = candidates[rerank.rerank(similarities[candidates], embeddings[candidates], timestamps[candidates],
+                                      NRESULTS, now=NOW, **weights)]
+    return selection_stats(picked, similarities, embeddings, timestamps, topic_ids, NOW)
+
+
+def mean_stats(**weights):
+    results = [pick(seed, **weights) for seed in SEEDS]
+    return {key: np.mean([result[key] for result in results]) for key in results[0]}
+
+
+def test_recency_recommends_fresher_posts():
+    nearest = mean_stats(recency_weight=0, diversity=0)
+    fresh = mean_stats(recency_weight=rerank.RERANK_RECENCY_WEIGHT, diversity=0)
+    assert fresh['mean_age_days'] < 0.5 * nearest['mean_age_days']
+    assert nearest['mean_similarity'] - fresh['mean_similarity'] < 0.05
+
+
+def test_diversity_recommends_less_redundant_posts():
+    nearest = mean_stats(recency_weight=0, diversity=0)
+    varied = mean_stats(recency_weight=0, diversity=rerank.RERANK_DIVERSITY)
+    assert varied['mean_pairwise_similarity'] < nearest['mean_pairwise_similarity'] - 0.1
+    assert varied['topics'] > nearest['topics']
+    assert nearest['mean_similarity'] - varied['mean_similarity'] < 0.05
+
+
+def test_default_weights_improve_age_and_redundancy_together():
+    nearest = mean_stats(recency_weight=0, diversity=0)
+    reranked = mean_stats(**rerank.DEFAULT_WEIGHTS)
+    assert reranked['mean_age_days'] < 0.5 * nearest['mean_age_days']
+    assert reranked['mean_pairwise_similarity'] < nearest['mean_pairwise_similarity'] - 0.15
+    assert nearest['mean_similarity'] - reranked['mean_similarity'] < 0.05
+
+
+def test_rerank_without_weights_keeps_nearest_neighbour_order():
+    similarities = np.array([0.2, 0.9, 0.5, 0.7], dtype=np.float32)
+    embeddings = np.eye(4, dtype=np.float32)
+    timestamps = np.array([NOW, NOW - 1e8, NOW, NOW - 1e8])
+    assert rerank.rerank(similarities, embeddings, timestamps, 3, recency_weight=0, diversity=0, now=NOW) == [1, 3, 2]
+
+
+def test_rerank_latency_at_production_dimensions():
+    embeddings, timestamps, _ = fixture_corpus(topics=5, posts_per_topic=20, dimensions=1536, seed=3, now=NOW)
+    similarities = embeddings @ embeddings[0]
+    runs = 50
+    best = float('inf')
+    # Best of several rounds, so a busy machine does not fail the bound
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(runs):
+            rerank.rerank(similarities, embeddings, timestamps, NRESULTS, now=NOW)
+        best = min(best, (time.perf_counter() - started) / runs)
+    assert best < 0.002
@@ -0,0 +1,62 @@
+import pytest
+import embedding
+from retry import is_retryable
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class APITimeoutError(APIConnectionError):
+    pass
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (StatusError(400), False),
+    (StatusError(401), False),
+    (StatusError(404), False),
+    (StatusError(408), True),
+    (StatusError(409), True),
+    (StatusError(429), True),
+    (StatusError(500), True),
+    (StatusError(503), True),
+    (TimeoutError(), True),
+    (APITimeoutError(), True),
+    (APIConnectionError(), True),
+    (ValueError('bad input'), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def failing_then(errors, embeddings):
+    calls = []
+
+    def embedding_function(texts):
+        calls.append(texts)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return embeddings
+
+    return embedding_function, calls
+
+
+def test_embed_with_retry_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(embedding.time, 'sleep', lambda seconds: None)
+    embedding_function, calls = failing_then([StatusError(429), TimeoutError()], [[0.5, 0.5]])
+    assert embedding.embed_with_retry(embedding_function, ['text']) == [[0.5, 0.5]]
+    assert len(calls) == 3
+
+
+def test_embed_with_retry_fails_fast_on_permanent_errors(monkeypatch):
+    monkeypatch.setattr(embedding.time, 'sleep', lambda seconds: pytest.fail('permanent errors must not back off'))
+    embedding_function, calls = failing_then([StatusError(400)], [[0.5, 0.5]])
+    with pytest.raises(StatusError):
+        embedding.embed_with_retry(embedding_function, ['text'])
+    assert len(calls) == 1
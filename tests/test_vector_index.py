@@ -0,0 +1,48 @@
+import uuid
+import numpy as np
+import pytest
+import vector_index
+
+chromadb = pytest.importorskip('chromadb')
+
+POSTS = 20
+CHUNKS_PER_POST = 8
+DIMENSIONS = 16
+
+
+@pytest.fixture
+def index():
+    # Long posts whose chunks are all near-identical, so one post can fill every slot of a query
+    rng = np.random.default_rng(0)
+    collection = chromadb.EphemeralClient().create_collection(f"test_{uuid.uuid4().hex}")
+    centers = rng.normal(size=(POSTS, DIMENSIONS))
+    ids, embeddings, metadatas = [], [], []
+    for post in range(POSTS):
+        for chunk in range(CHUNKS_PER_POST):
+            embedding = centers[post] + rng.normal(scale=1e-3, size=DIMENSIONS)
+            ids.append(f"{post}_{chunk}")
+            embeddings.append((embedding / np.linalg.norm(embedding)).tolist())
+            metadatas.append({"post_id": str(post), "timestamp": post})
+    collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas)
+    return vector_index.ChromaIndex(collection), embeddings
+
+
+def test_rank_returns_distinct_posts_despite_many_similar_chunks(index):
+    chroma_index, embeddings = index
+    ranked = chroma_index.rank([embeddings[0]], ["0"], 6)[0]
+    assert len(ranked) == len(set(ranked)) == 6
+    assert "0" not in ranked
+
+
+def test_candidates_return_every_post_when_asked_for_more_than_exist(index):
+    chroma_index, embeddings = index
+    post_ids, similarities, candidate_embeddings, timestamps = chroma_index.candidates([embeddings[0]], ["0"], 100)[0]
+    assert sorted(post_ids, key=int) == [str(post) for post in range(1, POSTS)]
+    assert candidate_embeddings.shape == (POSTS - 1, DIMENSIONS)
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_rank_stops_when_filtered_chunks_run_out(index):
+    chroma_index, embeddings = index
+    ranked = chroma_index.rank([embeddings[0]], ["0"], 10, min_timestamp=POSTS - 3)[0]
+    assert sorted(ranked, key=int) == [str(post) for post in range(POSTS - 3, POSTS)]
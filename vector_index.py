@@ -0,0 +1,295 @@
+import os
+import json
+import shutil
+import logging
+from datetime import datetime
+import numpy as np
+
+# Every chunk of a post is indexed as its own document, linked back to the post by its post_id metadata
+CHUNK_OVERFETCH = int(os.environ.get('CHUNK_OVERFETCH', 4))
+CHUNK_SCORE_AGGREGATION = os.environ.get('CHUNK_SCORE_AGGREGATION', 'max')
+INDEX_PAGE_SIZE = 1000
+# Candidate queries return chunk embeddings, so Chroma is asked for a few queries at a time to bound memory
+CANDIDATE_QUERY_BATCH = 10
+
+# Files of a NumPy index directory, all memory-mapped when the index is opened
+EMBEDDINGS_FILE = 'embeddings.npy'
+POST_EMBEDDINGS_FILE = 'post_embeddings.npy'
+POST_OFFSETS_FILE = 'post_offsets.npy'
+POST_IDS_FILE = 'post_ids.npy'
+TIMESTAMPS_FILE = 'timestamps.npy'
+INFO_FILE = 'index.json'
+
+
+# Function to mean-pool chunk embeddings into one unit-length post embedding
+def pool_embeddings(embeddings):
+    pooled = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(pooled)
+    return (pooled / norm if norm else pooled).tolist()
+
+
+def _post_id(id, metadata):
+    # Documents indexed before chunking have no post_id and use the post id as document id
+    return str((metadata or {}).get("post_id", id))
+
+
+class ChromaIndex:
+    """Vector backend that queries a Chroma collection directly."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def count(self):
+        return self.collection.count()
+
+    def post_embeddings(self, post_ids):
+        """Return the pooled embedding of every indexed post among post_ids, keyed by post id."""
+        stored = self.collection.get(where={"post_id": {"$in": [str(id) for id in post_ids]}},
+                                     include=["embeddings", "metadatas"])
+        chunk_embeddings = {}
+        for embedding, metadata in zip(stored["embeddings"], stored["metadatas"]):
+            chunk_embeddings.setdefault(metadata["post_id"], []).append(embedding)
+        return {post_id: pool_embeddings(embeddings) for post_id, embeddings in chunk_embeddings.items()}
+
+    def iter_post_embeddings(self):
+        """Yield (post_id, pooled embedding) for every indexed post."""
+        # Chunks of a post are written together, so they come back as one consecutive run
+        current_post_id, chunk_embeddings = None, []
+        for offset in range(0, self.collection.count(), INDEX_PAGE_SIZE):
+            batch = self.collection.get(include=["embeddings", "metadatas"], limit=INDEX_PAGE_SIZE, offset=offset)
+            for id, embedding, metadata in zip(batch["ids"], batch["embeddings"], batch["metadatas"]):
+                post_id = _post_id(id, metadata)
+                if post_id != current_post_id and chunk_embeddings:
+                    yield current_post_id, pool_embeddings(chunk_embeddings)
+                    chunk_embeddings = []
+                current_post_id = post_id
+                chunk_embeddings.append(embedding)
+        if chunk_embeddings:
+            yield current_post_id, pool_embeddings(chunk_embeddings)
+
+    def _group_posts(self, result, exclude_id):
+        posts = {}
+        for j, (id, metadata, distance) in enumerate(zip(result["ids"], result["metadatas"], result["distances"])):
+            post_id = _post_id(id, metadata)
+            if post_id != str(exclude_id):
+                post = posts.setdefault(post_id, {"distances": [], "chunks": [], "metadata": metadata or {}})
+                post["distances"].append(distance)
+                post["chunks"].append(j)
+        return posts
+
+    def _query_posts(self, query_embeddings, exclude_ids, nresults, nchunks, min_timestamp, include):
+        where = {"timestamp": {"$gte": int(min_timestamp)}} if min_timestamp is not None else None
+        fields = ["ids", "metadatas", "distances"] + include
+        results = [{field: [] for field in fields} for _ in query_embeddings]
+        grouped = [{} for _ in query_embeddings]
+        total = self.collection.count()
+        nchunks = min(nchunks, total)
+        pending = list(range(len(query_embeddings)))
+        while pending and nchunks:
+            result = self.collection.query(query_embeddings=[query_embeddings[i] for i in pending], n_results=nchunks,
+                                           where=where, include=["metadatas", "distances"] + include)
+            short = []
+            for k, i in enumerate(pending):
+                results[i] = {field: result[field][k] for field in fields}
+                grouped[i] = self._group_posts(results[i], exclude_ids[i])
+                # Long posts with many similar chunks can fill every slot, so ask again for more chunks
+                # until nresults distinct posts remain or the matching chunks run out
+                if len(grouped[i]) < nresults and len(results[i]["ids"]) == nchunks:
+                    short.append(i)
+            if nchunks == total:
+                break
+            pending, nchunks = short, min(nchunks * 2, total)
+
+        for i, posts in enumerate(grouped):
+            if CHUNK_SCORE_AGGREGATION == 'mean':
+                scores = {post_id: sum(p["distances"]) / len(p["distances"]) for post_id, p in posts.items()}
+            else:
+                scores = {post_id: min(p["distances"]) for post_id, p in posts.items()}
+            yield i, results[i], posts, sorted(scores, key=scores.get)[:nresults], scores
+
+    def rank(self, query_embeddings, exclude_ids, nresults, min_timestamp=None):
+        """Rank posts for many query embeddings at once, aggregating chunk distances per post."""
+        # Over-fetch chunks so that nresults distinct posts usually survive deduplication in a single query
+        return [ranked for _, _, _, ranked, _ in self._query_posts(
+            query_embeddings, exclude_ids, nresults, nresults * CHUNK_OVERFETCH + 1, min_timestamp, [])]
+
+    def candidates(self, query_embeddings, exclude_ids, ncandidates, min_timestamp=None):
+        """Return (post_ids, similarities, embeddings, timestamps) of the top candidate posts for every query."""
+        results = []
+        for start in range(0, len(query_embeddings), CANDIDATE_QUERY_BATCH):
+            # Chunk embeddings are returned too, so chunks are not over-fetched up front and only queries
+            # left short of ncandidates distinct posts are repeated
+            for i, result, posts, ranked, scores in self._query_posts(
+                    query_embeddings[start:start + CANDIDATE_QUERY_BATCH],
+                    exclude_ids[start:start + CANDIDATE_QUERY_BATCH], ncandidates, ncandidates + 1, min_timestamp,
+                    ["embeddings"]):
+                embeddings = np.asarray([pool_embeddings([result["embeddings"][j] for j in posts[post_id]["chunks"]])
+                                         for post_id in ranked], dtype=np.float32)
+                # Squared L2 distance between unit vectors is 2 - 2 * cosine similarity
+                results.append((ranked, [1 - scores[post_id] / 2 for post_id in ranked], embeddings,
+                                [int(posts[post_id]["metadata"].get("timestamp", 0)) for post_id in ranked]))
+        return results
+
+
+class NumpyIndex:
+    """In-process exact index over unit-length chunk embeddings, memory-mapped from an index directory.
+
+    Chunks are stored grouped by post, so per-post scores come from one matrix product and a reduceat.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INFO_FILE)) as f:
+            info = json.load(f)
+        self.name = info['collection']
+        # Empty arrays cannot be memory-mapped
+        mmap_mode = 'r' if info['chunks'] else None
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        self.post_embeddings_matrix = np.load(os.path.join(path, POST_EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        self.post_offsets = np.load(os.path.join(path, POST_OFFSETS_FILE))
+        self.post_ids = np.load(os.path.join(path, POST_IDS_FILE))
+        self.timestamps = np.load(os.path.join(path, TIMESTAMPS_FILE), mmap_mode=mmap_mode)
+        self.post_positions = {str(post_id): i for i, post_id in enumerate(self.post_ids)}
+        self.single_chunk = len(self.post_ids) == len(self.embeddings)
+
+    def count(self):
+        return len(self.embeddings)
+
+    def post_embeddings(self, post_ids):
+        positions = {str(post_id): self.post_positions.get(str(post_id)) for post_id in post_ids}
+        return {post_id: self.post_embeddings_matrix[i].tolist() for post_id, i in positions.items() if i is not None}
+
+    def iter_post_embeddings(self):
+        for post_id, embedding in zip(self.post_ids, self.post_embeddings_matrix):
+            yield str(post_id), embedding.tolist()
+
+    def post_scores(self, queries):
+        # Cosine similarity of every chunk to every query; embeddings are unit length
+        chunk_scores = self.embeddings @ queries.T
+        if self.single_chunk:
+            return chunk_scores
+        starts = self.post_offsets[:-1]
+        if CHUNK_SCORE_AGGREGATION == 'mean':
+            counts = np.diff(self.post_offsets).astype(np.float32)
+            return np.add.reduceat(chunk_scores, starts, axis=0) / counts[:, None]
+        return np.maximum.reduceat(chunk_scores, starts, axis=0)
+
+    def top_posts(self, query_embeddings, exclude_ids, nresults, min_timestamp=None):
+        """Return (positions, scores) of the best nresults posts for every query, best first."""
+        if not len(self.post_ids) or not query_embeddings:
+            return [([], []) for _ in query_embeddings]
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms, norms, 1)
+        scores = self.post_scores(queries)
+        if min_timestamp is not None:
+            scores[np.asarray(self.timestamps) < int(min_timestamp)] = -np.inf
+        for column, exclude_id in enumerate(exclude_ids):
+            position = self.post_positions.get(str(exclude_id))
+            if position is not None:
+                scores[position, column] = -np.inf
+
+        k = min(nresults, len(self.post_ids))
+        if k <= 0:
+            return [([], []) for _ in query_embeddings]
+        # Partial sort for the top k of every query at once, then order just those k
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        top_scores = np.take_along_axis(scores, top, axis=0)
+        order = np.argsort(-top_scores, axis=0, kind='stable')
+        top, top_scores = np.take_along_axis(top, order, axis=0), np.take_along_axis(top_scores, order, axis=0)
+        results = []
+        for column in range(len(query_embeddings)):
+            found = top_scores[:, column] > -np.inf
+            results.append((top[found, column], top_scores[found, column]))
+        return results
+
+    def rank(self, query_embeddings, exclude_ids, nresults, min_timestamp=None):
+        return [[str(self.post_ids[i]) for i in positions] for positions, _ in
+                self.top_posts(query_embeddings, exclude_ids, nresults, min_timestamp)]
+
+    def candidates(self, query_embeddings, exclude_ids, ncandidates, min_timestamp=None):
+        return [([str(self.post_ids[i]) for i in positions], scores, self.post_embeddings_matrix[positions],
+                 self.timestamps[positions])
+                for positions, scores in self.top_posts(query_embeddings, exclude_ids, ncandidates, min_timestamp)]
+
+
+# Function to write a NumPy index for a Chroma collection, streaming embeddings into memory-mapped files
+def build_numpy_index(collection, path, page_size=INDEX_PAGE_SIZE):
+    total = collection.count()
+    # First pass reads only metadata to group chunks by post
+    chunks = {}
+    timestamps = {}
+    for offset in range(0, total, page_size):
+        batch = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        for id, metadata in zip(batch["ids"], batch["metadatas"]):
+            post_id = _post_id(id, metadata)
+            chunks.setdefault(post_id, []).append((int((metadata or {}).get("chunk", 0)), id))
+            timestamps[post_id] = int((metadata or {}).get("timestamp", 0))
+    post_ids = list(chunks)
+    rows, offsets = {}, [0]
+    for post_id in post_ids:
+        for _, id in sorted(chunks[post_id]):
+            rows[id] = len(rows)
+        offsets.append(len(rows))
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    embeddings = None
+    # Second pass copies embeddings page by page into their grouped positions
+    for offset in range(0, total, page_size):
+        batch = collection.get(include=["embeddings"], limit=page_size, offset=offset)
+        page = np.asarray(batch["embeddings"], dtype=np.float32)
+        if not len(page):
+            continue
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(os.path.join(tmp_path, EMBEDDINGS_FILE), mode='w+',
+                                                   dtype=np.float32, shape=(len(rows), page.shape[1]))
+        norms = np.linalg.norm(page, axis=1, keepdims=True)
+        embeddings[[rows[id] for id in batch["ids"]]] = page / np.where(norms, norms, 1)
+    if embeddings is None:
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), np.zeros((0, 0), dtype=np.float32))
+        np.save(os.path.join(tmp_path, POST_EMBEDDINGS_FILE), np.zeros((0, 0), dtype=np.float32))
+    else:
+        post_embeddings = np.lib.format.open_memmap(os.path.join(tmp_path, POST_EMBEDDINGS_FILE), mode='w+',
+                                                    dtype=np.float32, shape=(len(post_ids), embeddings.shape[1]))
+        for i in range(len(post_ids)):
+            post_embeddings[i] = pool_embeddings(embeddings[offsets[i]:offsets[i + 1]])
+        embeddings.flush()
+        post_embeddings.flush()
+    np.save(os.path.join(tmp_path, POST_OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(tmp_path, POST_IDS_FILE), np.asarray(post_ids, dtype=str))
+    np.save(os.path.join(tmp_path, TIMESTAMPS_FILE), np.asarray([timestamps[id] for id in post_ids], dtype=np.int64))
+    with open(os.path.join(tmp_path, INFO_FILE), 'w') as f:
+        json.dump({'collection': collection.name, 'chunks': len(rows), 'posts': len(post_ids),
+                   'created': datetime.utcnow().isoformat()}, f)
+    # Readers only open complete directories
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logging.info(f"NumPy index for {collection.name} written to {path}: {len(post_ids)} posts, {len(rows)} chunks")
+
+
+# Function to open the NumPy index for a collection, building it when it does not exist yet
+def open_numpy_index(collection, index_root):
+    path = os.path.join(index_root, collection.name)
+    if os.path.exists(os.path.join(path, INFO_FILE)):
+        try:
+            index = NumpyIndex(path)
+            if index.count() == collection.count():
+                return index
+            logging.info(f"NumPy index at {path} is out of date, rebuilding")
+        except Exception as e:
+            logging.error(f"Error opening NumPy index at {path}: {e}")
+    build_numpy_index(collection, path)
+    return NumpyIndex(path)
+
+
+# Function to remove NumPy indexes of collection generations that no longer exist
+def delete_numpy_indexes(index_root, kept_names):
+    if not os.path.isdir(index_root):
+        return
+    for name in os.listdir(index_root):
+        if name not in kept_names:
+            shutil.rmtree(os.path.join(index_root, name), ignore_errors=True)
+            logging.info(f"Deleted NumPy index {name}")